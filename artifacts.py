@@ -0,0 +1,120 @@
+import mmap
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from exceptions import ArtifactNotFoundError
+from logger import logger
+from settings import ARTIFACTS_DIR
+
+
+class ArtifactStore:
+    """Хранилище именованных буферов, которые задача передает зависимым задачам без копирования.
+
+    Буфер - файл <каталог>/<идентификатор задачи>/<имя>, отображенный в память через mmap. Путь
+    вычисляется по идентификатору, поэтому буферы доступны и из пула потоков, и из пула процессов.
+    Зависимые задачи получают memoryview только для чтения поверх общей страницы памяти.
+    Читатели буферов учитываются при планировании зависимых задач, в том числе отложенных и
+    восстановленных из журнала. Буферы задачи удаляются, когда завершится последняя запланированная
+    зависимая от нее задача; буферы, у которых читателей не было, остаются до clean_up.
+    """
+
+    def __init__(self, path=ARTIFACTS_DIR):
+        self.path = path
+        # задача-производитель -> число запланированных зависимых задач, которые еще не завершились
+        self.readers: Dict[int, int] = {}
+        # пока очередь восстанавливается из журнала, известны не все читатели: удаление откладывается
+        self.deferred: Optional[List[int]] = None
+
+    def job_path(self, job_id: int) -> str:
+        return os.path.join(self.path, str(job_id))
+
+    @contextmanager
+    def create(self, job, name: str, size: int) -> Iterator[memoryview]:
+        """Выделяет буфер размером size для записи на месте; буфер виден читателям после выхода из блока"""
+        directory = self.job_path(job.unique_name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w+b") as file:
+            file.truncate(size)
+            if size:
+                with mmap.mmap(file.fileno(), size) as buffer:
+                    view = memoryview(buffer)
+                    try:
+                        yield view
+                    finally:
+                        view.release()
+                    buffer.flush()
+            else:
+                yield memoryview(bytearray())
+        os.replace(tmp_path, path)
+
+    def publish(self, job, name: str, data) -> None:
+        """Публикует готовые данные: одно копирование в общий буфер"""
+        data = memoryview(data).cast("B")
+        with self.create(job, name, data.nbytes) as buffer:
+            buffer[:] = data
+
+    def open(self, job_id: int, name: str) -> memoryview:
+        """Буфер задачи job_id только для чтения, данные не копируются"""
+        with open(os.path.join(self.job_path(job_id), name), "rb") as file:
+            if not os.fstat(file.fileno()).st_size:
+                return memoryview(b"")
+            # отображение остается действительным после закрытия файла и его удаления
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def find(self, job, name: str) -> memoryview:
+        """Буфер с именем name, опубликованный одной из зависимостей задачи"""
+        for dependency in job.dependencies:
+            if os.path.isfile(os.path.join(self.job_path(dependency), name)):
+                return self.open(dependency, name)
+        raise ArtifactNotFoundError(
+            f"Artifact {name!r} of task {job.unique_name} is not published by its dependencies {job.dependencies}"
+        )
+
+    def add_reader(self, dependencies: Iterable[int]) -> None:
+        """Запланирована задача, которая может прочитать буферы своих зависимостей"""
+        for dependency in dependencies:
+            self.readers[dependency] = self.readers.get(dependency, 0) + 1
+
+    def release(self, dependencies: Iterable[int]) -> None:
+        """Задача завершена и больше не будет читать буферы своих зависимостей"""
+        for dependency in dependencies:
+            readers = self.readers.get(dependency)
+            if readers is None:
+                continue
+            if readers > 1:
+                self.readers[dependency] = readers - 1
+                continue
+            del self.readers[dependency]
+            if self.deferred is None:
+                self.remove(dependency)
+            else:
+                self.deferred.append(dependency)
+
+    def defer_removal(self) -> None:
+        self.deferred = []
+
+    def resume_removal(self) -> None:
+        """Удаляет отложенные буферы, у которых после восстановления очереди не осталось читателей"""
+        deferred, self.deferred = self.deferred or [], None
+        for job_id in deferred:
+            if job_id not in self.readers:
+                self.remove(job_id)
+
+    def remove(self, job_id: int) -> None:
+        path = self.job_path(job_id)
+        if os.path.isdir(path):
+            logger.debug(f"Remove artifacts of {job_id}")
+            shutil.rmtree(path, ignore_errors=True)
+
+    def clear(self) -> None:
+        self.readers.clear()
+        self.deferred = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# хранилище по умолчанию: задачи публикуют и читают буферы через него в любом потоке и процессе
+artifacts = ArtifactStore()
@@ -0,0 +1,173 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from typing import Dict, Iterator, Optional, Tuple
+
+from exceptions import DependencyError, StopEventLoop
+from job import Job
+from logger import logger
+from scheduler import Scheduler
+from settings import POOL_SIZE
+
+
+class AsyncScheduler(Scheduler):
+    """Планировщик поверх asyncio: выполняет задачи-генераторы и задачи с async def run.
+
+    Шаги асинхронных задач выполняются конкурентно в виде asyncio-задач, шаги синхронных
+    задач чередуются с ними и отдают управление циклу событий после каждого next().
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE):
+        # шаги асинхронных задач, которые сейчас выполняются в цикле событий
+        self.pending_steps: Dict[Iterator, asyncio.Future] = {}
+        self._async_wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        super().__init__(pool_size)
+
+    def wake(self) -> None:
+        super().wake()
+        # run_async может завершиться в другом потоке: берем событие и цикл один раз
+        wakeup, loop = self._async_wakeup, self._loop
+        if wakeup is None or loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            # цикл событий закрылся после проверки
+            pass
+
+    def create_task_iterator(self, task: Job) -> Iterator:
+        if task.is_async:
+            return task.run()
+        return super().create_task_iterator(task)
+
+    async def wait_wakeup_async(self, *futures: asyncio.Future) -> None:
+        """Ждет ближайшего дедлайна, вызова schedule или завершения одного из переданных шагов"""
+        wakeup = asyncio.ensure_future(self._async_wakeup.wait())
+        started = time.perf_counter()
+        try:
+            await asyncio.wait({wakeup, *futures}, timeout=self.get_wakeup_timeout(),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            wakeup.cancel()
+            self.metrics.add_idle(time.perf_counter() - started)
+        self._async_wakeup.clear()
+
+    async def wait_next_deadline_async(self) -> None:
+        if self.restoring is not None:
+            return
+        if not self.delayed_tasks:
+            # ничего не выполняется и не запланировано, а оставшиеся задачи ждут зависимостей
+            raise DependencyError
+        await self.wait_wakeup_async()
+
+    def poll_async_step(self, running_task: AsyncIterator) -> Tuple[bool, bool]:
+        """Проверяет шаг асинхронной задачи и запускает следующий.
+
+        Возвращает пару (задача остается в пуле, задача продвинулась за этот вызов).
+        """
+        task = self.tasks_mapping[running_task]
+        step = self.pending_steps.get(running_task)
+        if step is not None and not step.done():
+            if not task.is_expired:
+                return True, False
+            step.cancel()
+            error: Optional[BaseException] = TimeoutError()
+        else:
+            error = step.exception() if step is not None else None
+            if error is None and step is not None and task.is_expired:
+                error = TimeoutError()
+
+        if error is not None:
+            del self.pending_steps[running_task]
+            self.handle_task_exit(task, error)
+            return False, True
+        if step is not None:
+            self.dirty_tasks.setdefault(task.unique_name, task)
+        self.pending_steps[running_task] = asyncio.ensure_future(running_task.__anext__())
+        return True, True
+
+    async def step_running_tasks_async(self) -> bool:
+        """Проходит по пулу один раз, возвращает True, если хотя бы одна задача продвинулась"""
+        progressed = False
+        for _ in range(len(self.running_tasks)):
+            if self.control.stop_requested:
+                raise StopEventLoop
+            running_task = self.running_tasks[0]
+            if isinstance(running_task, AsyncIterator):
+                started = time.perf_counter()
+                task = self.tasks_mapping[running_task]
+                keep, advanced = self.poll_async_step(running_task)
+                if advanced:
+                    # для асинхронных задач учитывается время в цикле планировщика, без ожидания ввода-вывода
+                    seconds = time.perf_counter() - started
+                    self.metrics.observe_step(task, seconds)
+                    self.tracer.step(task, started, seconds)
+            else:
+                keep, advanced = self.run_quantum(running_task)
+                # отдаем управление остальным корутинам цикла событий
+                await asyncio.sleep(0)
+            progressed = progressed or advanced
+            if keep:
+                self.running_tasks.rotate(-1)
+            else:
+                self.remove_running_task(running_task)
+        return progressed
+
+    def run(self):
+        """Синхронный вход: цикл планировщика запускается в новом цикле событий"""
+        asyncio.run(self.run_async())
+
+    async def run_async(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._async_wakeup = asyncio.Event()
+        self.open_control(self._loop)
+        try:
+            while any([self.restoring, self.delayed_tasks, self.ready_tasks, self.waiting_tasks, self.running_tasks]):
+                self.check_control()
+                if self.control.paused:
+                    await self._async_wakeup.wait()
+                    self._async_wakeup.clear()
+                    continue
+                tick_started = time.perf_counter()
+                self.restore_batch()
+                self.release_due_tasks()
+                self.admit_ready_tasks()
+                if not self.running_tasks:
+                    await self.wait_next_deadline_async()
+                    continue
+                progressed = await self.step_running_tasks_async()
+                self.commit_pass()
+                self.metrics.observe_tick(time.perf_counter() - tick_started)
+                if not progressed:
+                    # все задачи пула ждут ввода-вывода или блокирующую работу в пуле потоков
+                    parked = [asyncio.wrap_future(future) for future in self.parked_tasks.values()]
+                    await self.wait_wakeup_async(*self.pending_steps.values(), *parked)
+
+            logger.info("All tasks done. Start clean up")
+            self.clean_up()
+        except StopEventLoop:
+            logger.info("Get stop signal from control channel")
+            self.stop()
+        except KeyboardInterrupt:
+            logger.info("Get stop signal from KeyboardInterrupt")
+            self.stop()
+        except asyncio.CancelledError:
+            logger.info("Scheduler coroutine was cancelled")
+            self.stop()
+            raise
+        except DependencyError:
+            logger.error("Dependencies of the remaining tasks can't be met, stop with saving")
+            self.stop()
+        finally:
+            self.close_control()
+            self._async_wakeup = None
+            self._loop = None
+            self.done_log.commit(force=True)
+            self.shutdown_offload_pool()
+
+    def stop(self, save_data=True) -> None:
+        for step in self.pending_steps.values():
+            step.cancel()
+        self.pending_steps.clear()
+        super().stop(save_data=save_data)
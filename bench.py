@@ -0,0 +1,280 @@
+"""Воспроизводимые замеры планировщика: пропускная способность, задержка запуска и время рестарта.
+
+Пример: python bench.py --jobs 1000 10000 --shapes chain fanout random --kinds noop many_yield
+Память на задачу в очереди: python bench.py --memory --jobs 1000000 --shapes independent chain
+Масштабирование по исполнителям с общим хранилищем: python bench.py --workers 1 2 4 --shapes independent --kinds sleep
+Каждый сценарий выполняется в отдельном процессе и во временной директории, результат пишется в JSON.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List
+
+from job import Job
+from logger import logger
+from offload import Blocking
+from scheduler import Scheduler
+from settings import POOL_SIZE, TASK_STORE
+from task_store import DONE, TaskStore
+from worker import StoreWorker
+
+SHAPES = ("independent", "chain", "fanout", "random")
+KINDS = ("noop", "many_yield", "sleep")
+
+
+class BenchJob(Job):
+    """Синтетическая задача: отмечает время первого и последнего шага"""
+
+    __slots__ = ("steps", "sleep", "ready_at", "first_step_at", "finished_at")
+
+    def __init__(self, steps=1, sleep=0.0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps = steps
+        self.sleep = sleep
+        self.ready_at = 0.0
+        self.first_step_at = 0.0
+        self.finished_at = 0.0
+
+    def run(self):
+        self.first_step_at = time.perf_counter()
+        for _ in range(self.steps):
+            if self.sleep:
+                yield Blocking(time.sleep, self.sleep)
+            else:
+                yield self
+        self.finished_at = time.perf_counter()
+
+    def reset(self):
+        self.first_step_at = self.finished_at = 0.0
+
+
+def build_jobs(shape: str, kind: str, count: int, seed: int) -> List[BenchJob]:
+    steps, sleep = {"noop": (1, 0.0), "many_yield": (100, 0.0), "sleep": (2, 0.001)}[kind]
+    rng = random.Random(seed)
+    jobs: List[BenchJob] = []
+    for index in range(count):
+        if shape == "chain":
+            dependencies = jobs[-1:]
+        elif shape == "fanout":
+            # корень -> count - 2 независимых задачи -> одна задача, ждущая их всех
+            if index == 0:
+                dependencies = []
+            elif index < count - 1:
+                dependencies = jobs[:1]
+            else:
+                dependencies = jobs[1:]
+        elif shape == "random":
+            dependencies = rng.sample(jobs, min(len(jobs), rng.randint(0, 3)))
+        else:
+            dependencies = []
+        jobs.append(BenchJob(steps=steps, sleep=sleep, dependencies=dependencies))
+    return jobs
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def at(fraction: float) -> float:
+        return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 3)
+
+    mean = round(statistics.mean(values) * 1000, 3)
+    return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": at(1.0), "mean": mean}
+
+
+@contextmanager
+def workdir() -> Iterator[str]:
+    """Файлы журнала и выполненных задач создаются во временной директории, которая затем удаляется"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="scheduler-bench-") as path:
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(previous)
+
+
+def measure_restart(shape: str, kind: str, count: int, seed: int, pool_size: int = POOL_SIZE) -> Dict[str, float]:
+    scheduler = Scheduler(pool_size)
+    scheduler.schedule_many(build_jobs(shape, kind, count, seed))
+    started = time.perf_counter()
+    scheduler.stop()
+    stopped = time.perf_counter()
+    restored = Scheduler(pool_size)
+    resumed = time.perf_counter()
+    restored.admit_ready_tasks()
+    if restored.running_tasks:
+        restored.step_task(restored.running_tasks[0])
+    first_step = time.perf_counter()
+    restored.restore_all()
+    result = {
+        "stop_seconds": round(stopped - started, 4),
+        "resume_seconds": round(resumed - stopped, 4),
+        "first_step_seconds": round(first_step - stopped, 4),
+        "restored_tasks": restored.live_tasks_count,
+        "journal_bytes": restored.journal.size(),
+    }
+    restored.clean_up()
+    return result
+
+
+def measure_memory(shape: str, count: int, seed: int = 0) -> Dict:
+    """Память на задачу в очереди и размер журнала и снапшота на задачу"""
+    with workdir():
+        tracemalloc.start()
+        scheduler = Scheduler()
+        scheduler.schedule_many(build_jobs(shape, "noop", count, seed))
+        queued_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        scheduler.journal.flush()
+        journal_bytes = os.path.getsize(scheduler.journal.path)
+        scheduler.compact()
+        snapshot_bytes = os.path.getsize(scheduler.journal.snapshot_path)
+        scheduler.clean_up()
+    return {
+        "shape": shape,
+        "jobs": count,
+        "bytes_per_queued_job": round(queued_bytes / count, 1),
+        "journal_bytes_per_job": round(journal_bytes / count, 1),
+        "snapshot_bytes_per_job": round(snapshot_bytes / count, 1),
+    }
+
+
+def run_store_worker(path: str, pool_size: int) -> None:
+    StoreWorker(path, pool_size=pool_size).run()
+
+
+def measure_workers(shape: str, kind: str, count: int, workers: int, seed: int = 0,
+                    pool_size: int = POOL_SIZE) -> Dict:
+    """Пропускная способность нескольких процессов-исполнителей с общим хранилищем задач"""
+    with workdir():
+        store = TaskStore(TASK_STORE)
+        store.submit(build_jobs(shape, kind, count, seed))
+        started = time.perf_counter()
+        processes = [multiprocessing.Process(target=run_store_worker, args=(TASK_STORE, pool_size))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        finished = time.perf_counter()
+        completed = store.counts().get(DONE, 0)
+        store.close()
+        return {
+            "shape": shape,
+            "kind": kind,
+            "jobs": count,
+            "workers": workers,
+            "completed": completed,
+            "run_seconds": round(finished - started, 4),
+            "jobs_per_sec": round(completed / (finished - started), 1),
+        }
+
+
+def run_scenario(shape: str, kind: str, count: int, seed: int = 0, restart: bool = True,
+                 pool_size: int = POOL_SIZE) -> Dict:
+    with workdir():
+        result: Dict = {"shape": shape, "kind": kind, "jobs": count}
+        if restart:
+            result.update(measure_restart(shape, kind, count, seed, pool_size))
+
+        jobs = build_jobs(shape, kind, count, seed)
+        scheduler = Scheduler(pool_size)
+        started = time.perf_counter()
+        scheduler.schedule_many(jobs)
+        scheduled = time.perf_counter()
+        for job in jobs:
+            job.ready_at = scheduled
+        scheduler.run()
+        finished = time.perf_counter()
+
+        # задача готова к запуску, когда завершилась ее последняя зависимость
+        finished_at = {job.unique_name: job.finished_at for job in jobs}
+        latencies = [
+            job.first_step_at - max([job.ready_at] + [finished_at[dependency] for dependency in job.dependencies])
+            for job in jobs
+            if job.first_step_at
+        ]
+        total_steps = sum(job.steps for job in jobs) + len(jobs)
+        result.update({
+            "completed": len(scheduler.done_tasks),
+            "schedule_seconds": round(scheduled - started, 4),
+            "run_seconds": round(finished - scheduled, 4),
+            "steps": total_steps,
+            "steps_per_sec": round(total_steps / (finished - scheduled), 1),
+            "admission_latency_ms": percentiles(latencies),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        })
+        return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES))
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=["noop", "many_yield"])
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-restart", action="store_true", help="не замерять stop() и восстановление")
+    parser.add_argument("--memory", action="store_true", help="замерить только память и журнал на задачу в очереди")
+    parser.add_argument("--workers", type=int, nargs="+", help="замерить исполнители с общим хранилищем задач")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    logger.setLevel(logging.WARNING)
+    if args.memory:
+        scenarios = [(measure_memory, (shape, count, args.seed)) for count in args.jobs for shape in args.shapes]
+    elif args.workers:
+        scenarios = [
+            (measure_workers, (shape, kind, count, workers, args.seed, args.pool_size))
+            for count in args.jobs
+            for shape in args.shapes
+            for kind in args.kinds
+            for workers in args.workers
+        ]
+    else:
+        scenarios = [
+            (run_scenario, (shape, kind, count, args.seed, not args.no_restart, args.pool_size))
+            for count in args.jobs
+            for shape in args.shapes
+            for kind in args.kinds
+        ]
+    results = []
+    for function, scenario in scenarios:
+        # отдельный процесс на сценарий, чтобы пиковая память не смешивалась
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(function, *scenario).result()
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pool_size": args.pool_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+from typing import Callable, Dict, Optional
+
+from logger import logger
+
+COMMANDS = ("stop", "drain", "pause", "resume", "status")
+
+
+class SchedulerControl:
+    """Канал управления циклом планировщика: остановка, дренаж, пауза и статус.
+
+    Цикл проверяет только флаги в памяти. Команды приходят из обработчиков сигналов
+    (SIGTERM/SIGINT - остановка, SIGUSR1 - пауза/продолжение) или через локальный Unix-сокет.
+    """
+
+    def __init__(self, wakeup: Callable[[], None], status: Callable[[], Dict]):
+        self.stop_requested = False
+        self.draining = False
+        self.paused = False
+        self._wakeup = wakeup
+        self._status = status
+        self._server: Optional[socketserver.UnixStreamServer] = None
+        self._previous_handlers: Dict[int, object] = {}
+
+    def reset(self) -> None:
+        self.stop_requested = False
+        self.draining = False
+        self.paused = False
+
+    def stop(self) -> None:
+        logger.info("Stop requested")
+        self.stop_requested = True
+        self._wakeup()
+
+    def drain(self) -> None:
+        """Новые задачи не запускаются, после завершения выполняемых планировщик останавливается"""
+        logger.info("Drain requested")
+        self.draining = True
+        self._wakeup()
+
+    def pause(self) -> None:
+        logger.info("Pause requested")
+        self.paused = True
+
+    def resume(self) -> None:
+        logger.info("Resume requested")
+        self.paused = False
+        self._wakeup()
+
+    def toggle_pause(self) -> None:
+        if self.paused:
+            self.resume()
+        else:
+            self.pause()
+
+    def status(self) -> Dict:
+        return {
+            **self._status(),
+            "stop_requested": self.stop_requested,
+            "draining": self.draining,
+            "paused": self.paused,
+        }
+
+    def execute(self, command: str) -> Dict:
+        if command not in COMMANDS:
+            return {"error": f"Unknown command {command!r}, expected one of {COMMANDS}"}
+        if command != "status":
+            getattr(self, command)()
+        return self.status()
+
+    def install_signal_handlers(self, loop=None) -> None:
+        """Ставит обработчики сигналов; без цикла asyncio это возможно только в главном потоке"""
+        handlers = {signal.SIGTERM: self.stop, signal.SIGINT: self.stop, signal.SIGUSR1: self.toggle_pause}
+        if loop is not None:
+            for signum, handler in handlers.items():
+                loop.add_signal_handler(signum, handler)
+                self._previous_handlers[signum] = loop
+            return
+        if threading.current_thread() is not threading.main_thread():
+            logger.debug("Not in the main thread, signal handlers are not installed")
+            return
+        for signum, handler in handlers.items():
+            self._previous_handlers[signum] = signal.signal(signum, lambda *_, handler=handler: handler())
+
+    def restore_signal_handlers(self) -> None:
+        for signum, previous in self._previous_handlers.items():
+            if hasattr(previous, "remove_signal_handler"):
+                previous.remove_signal_handler(signum)
+            else:
+                signal.signal(signum, previous)
+        self._previous_handlers.clear()
+
+    def serve(self, path: str) -> None:
+        """Запускает в фоновом потоке сервер команд на Unix-сокете"""
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = socketserver.ThreadingUnixStreamServer(path, ControlRequestHandler)
+        self._server.control = self  # type: ignore[attr-defined]
+        threading.Thread(target=self._server.serve_forever, name="scheduler-control", daemon=True).start()
+        logger.info(f"Control socket listening on {path}")
+
+    def shutdown_server(self) -> None:
+        if self._server is None:
+            return
+        path = self._server.server_address
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        if isinstance(path, str) and os.path.exists(path):
+            os.remove(path)
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        command = self.rfile.readline().decode().strip()
+        response = self.server.control.execute(command)  # type: ignore[attr-defined]
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+def send_command(path: str, command: str) -> Dict:
+    """Отправляет команду планировщику через управляющий сокет и возвращает его статус"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((command + "\n").encode())
+        with sock.makefile("rb") as file:
+            return json.loads(file.readline())
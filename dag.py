@@ -0,0 +1,72 @@
+from collections import defaultdict, deque
+from typing import DefaultDict, Deque, Dict, List, Set, Tuple
+
+from exceptions import DependencyCycleError, DependencyError, UnknownDependencyError
+from job import Job, JobId
+
+
+def plan_pipeline(jobs: List[Job], known: Set[JobId]) -> List[Job]:
+    """Проверяет граф зависимостей пайплайна за O(V + E) и возвращает задачи в топологическом порядке.
+
+    Зависимость должна входить в пайплайн или быть в known (уже запланирована или выполнена).
+    Каждой задаче проставляется critical_path - длина самой длинной цепочки задач пайплайна,
+    которая начинается с нее: такие задачи запускаются первыми.
+    """
+    by_name: Dict[JobId, Job] = {}
+    for job in jobs:
+        if job.unique_name in by_name or job.unique_name in known:
+            raise DependencyError(f"Job {job.unique_name} is scheduled twice")
+        by_name[job.unique_name] = job
+
+    pending, dependents = build_graph(jobs, by_name, known)
+    queue: Deque[Job] = deque(job for job in jobs if not pending[job.unique_name])
+    order: List[Job] = []
+    while queue:
+        job = queue.popleft()
+        order.append(job)
+        for dependent in dependents[job.unique_name]:
+            pending[dependent.unique_name] -= 1
+            if not pending[dependent.unique_name]:
+                queue.append(dependent)
+    if len(order) < len(jobs):
+        cycle = find_cycle([job for job in jobs if pending[job.unique_name]], by_name)
+        raise DependencyCycleError(f"Dependency cycle (job -> its dependency): {' -> '.join(cycle)}")
+
+    for job in reversed(order):
+        job.critical_path = 1 + max((dependent.critical_path for dependent in dependents[job.unique_name]), default=0)
+    return order
+
+
+def build_graph(
+    jobs: List[Job], by_name: Dict[JobId, Job], known: Set[JobId]
+) -> Tuple[Dict[JobId, int], DefaultDict[JobId, List[Job]]]:
+    """Число зависимостей внутри пайплайна у каждой задачи и обратные ребра графа"""
+    pending: Dict[JobId, int] = dict.fromkeys(by_name, 0)
+    dependents: DefaultDict[JobId, List[Job]] = defaultdict(list)
+    for job in jobs:
+        for dependency in job.dependencies:
+            if dependency in by_name:
+                pending[job.unique_name] += 1
+                dependents[dependency].append(job)
+            elif dependency not in known:
+                raise UnknownDependencyError(
+                    f"Job {job.unique_name} depends on {dependency}, which was never scheduled"
+                )
+    return pending, dependents
+
+
+def find_cycle(blocked: List[Job], by_name: Dict[JobId, Job]) -> List[str]:
+    """Находит цикл среди задач, которые не попали в топологический порядок.
+
+    У каждой такой задачи есть незавершенная зависимость из этого же множества, поэтому
+    проход по зависимостям рано или поздно возвращается в уже посещенную задачу.
+    """
+    blocked_names = {job.unique_name for job in blocked}
+    path: List[str] = []
+    visited: Dict[JobId, int] = {}
+    job = blocked[0]
+    while job.unique_name not in visited:
+        visited[job.unique_name] = len(path)
+        path.append(str(job.unique_name))
+        job = by_name[next(dependency for dependency in job.dependencies if dependency in blocked_names)]
+    return path[visited[job.unique_name]:] + [str(job.unique_name)]
@@ -0,0 +1,80 @@
+import os
+import time
+from typing import List, Optional, TextIO
+
+from logger import logger
+from settings import DONE_TASKS, DONE_TASKS_COMMIT_INTERVAL_MS, DONE_TASKS_FSYNC, DONE_TASKS_FSYNC_INTERVAL_MS
+
+# политики синхронизации с диском
+FSYNC_NONE = "none"
+FSYNC_BATCH = "batch"
+FSYNC_INTERVAL = "interval"
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_BATCH, FSYNC_INTERVAL)
+
+
+class DoneLog:
+    """Буферизованный файл выполненных задач с групповой записью.
+
+    Идентификаторы копятся в памяти и пишутся одной группой за проход цикла (или раз в окно
+    DONE_TASKS_COMMIT_INTERVAL_MS), fsync выполняется по выбранной политике.
+    """
+
+    def __init__(
+        self,
+        path=DONE_TASKS,
+        fsync_policy=DONE_TASKS_FSYNC,
+        fsync_interval_ms=DONE_TASKS_FSYNC_INTERVAL_MS,
+        commit_interval_ms=DONE_TASKS_COMMIT_INTERVAL_MS,
+    ):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync_policy!r}, expected one of {FSYNC_POLICIES}")
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.commit_interval = commit_interval_ms / 1000
+        self.buffer: List[int] = []
+        self._file: Optional[TextIO] = None
+        self._not_synced = False
+        self._last_commit = self._last_fsync = time.monotonic()
+
+    @property
+    def file(self) -> TextIO:
+        if self._file is None:
+            self._file = open(self.path, "a")
+        return self._file
+
+    def truncate(self) -> None:
+        self.close()
+        with open(self.path, "w"):
+            pass
+
+    def append(self, unique_name: int) -> None:
+        self.buffer.append(unique_name)
+
+    def commit(self, force=False) -> None:
+        """Записывает накопленную группу одним вызовом write и синхронизирует ее по политике"""
+        now = time.monotonic()
+        if self.buffer and (force or now - self._last_commit >= self.commit_interval):
+            self.file.write("".join(f"{unique_name}\n" for unique_name in self.buffer))
+            self.file.flush()
+            logger.debug(f"Commit {len(self.buffer)} done tasks")
+            self.buffer.clear()
+            self._last_commit = now
+            self._not_synced = True
+        if self._not_synced and self.should_fsync(now, force):
+            os.fsync(self.file.fileno())
+            self._last_fsync = now
+            self._not_synced = False
+
+    def should_fsync(self, now: float, force: bool) -> bool:
+        if self.fsync_policy == FSYNC_NONE:
+            return False
+        if self.fsync_policy == FSYNC_BATCH or force:
+            return True
+        return now - self._last_fsync >= self.fsync_interval
+
+    def close(self) -> None:
+        self.commit(force=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -5,3 +5,19 @@ class StopEventLoop(Exception):
 
 class TaskError(Exception):
     pass
+
+
+class DependencyError(Exception):
+    pass
+
+
+class UnknownDependencyError(DependencyError):
+    pass
+
+
+class DependencyCycleError(DependencyError):
+    pass
+
+
+class ArtifactNotFoundError(Exception):
+    pass
@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import math
+import time
+from collections import defaultdict
+from typing import DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+from job import Job
+from settings import PRIORITY_AGING_SECONDS, QUEUE_LIMITS, QUEUE_WEIGHTS
+
+
+class QueueStats:
+    def __init__(self):
+        self.admitted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, wait: float) -> None:
+        self.admitted += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class FairQueue:
+    """Очередь готовых задач со взвешенным справедливым распределением мест в пуле.
+
+    Каждая очередь (task.queue) получает места пропорционально своему весу: выбирается очередь
+    с наименьшим виртуальным временем, которое растет на 1 / вес за каждую запущенную задачу.
+    Внутри очереди первой идет задача с наибольшим приоритетом, а ожидание повышает приоритет
+    на 1 за каждые aging секунд, поэтому задачи с низким приоритетом не ждут бесконечно.
+    При равном приоритете первой запускается задача на самом длинном критическом пути пайплайна.
+    Очередь, достигшая своего лимита выполняемых задач, пропускается.
+    """
+
+    def __init__(self, weights: Dict[str, float] = QUEUE_WEIGHTS, limits: Dict[str, int] = QUEUE_LIMITS,
+                 aging: float = PRIORITY_AGING_SECONDS):
+        self.weights = weights
+        self.limits = limits
+        self.aging = aging
+        # очередь -> куча (приоритет со старением, критический путь, порядковый номер, время готовности, задача)
+        self.queues: DefaultDict[str, List[Tuple[int, int, int, float, Job]]] = defaultdict(list)
+        self.virtual_time: DefaultDict[str, float] = defaultdict(float)
+        self.running: DefaultDict[str, int] = defaultdict(int)
+        self.stats: DefaultDict[str, QueueStats] = defaultdict(QueueStats)
+        # виртуальное время последней запущенной задачи, с него начинает очередь, которая была пуста
+        self.clock = 0.0
+        self._sequence = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Job]:
+        for entries in self.queues.values():
+            for *_, task in sorted(entries):
+                yield task
+
+    def __repr__(self) -> str:
+        return f"FairQueue({ {queue: len(entries) for queue, entries in self.queues.items()} })"
+
+    def append(self, task: Job) -> None:
+        entries = self.queues[task.queue]
+        if not entries:
+            # простаивавшая очередь не накапливает права на внеочередной запуск
+            self.virtual_time[task.queue] = max(self.virtual_time[task.queue], self.clock)
+        ready_at = time.monotonic()
+        # приоритет с учетом старения: priority + (now - ready_at) // aging, now у всех задач общее.
+        # При равном приоритете первой идет задача с более длинным критическим путем
+        key = math.floor(ready_at / self.aging) - task.priority if self.aging else -task.priority
+        heapq.heappush(entries, (key, -task.critical_path, next(self._sequence), ready_at, task))
+        self._size += 1
+
+    def pop(self) -> Optional[Tuple[Job, float]]:
+        """Следующая задача для запуска и ее ожидание в очереди в секундах
+        или None, если все очереди с задачами достигли лимита"""
+        candidates = [
+            queue for queue, entries in self.queues.items()
+            if entries and self.running[queue] < self.limits.get(queue, float("inf"))
+        ]
+        if not candidates:
+            return None
+        queue = min(candidates, key=lambda name: (self.virtual_time[name], name))
+        *_, ready_at, task = heapq.heappop(self.queues[queue])
+        self._size -= 1
+        self.clock = self.virtual_time[queue]
+        self.virtual_time[queue] += 1 / self.weights.get(queue, 1)
+        wait = time.monotonic() - ready_at
+        self.stats[queue].observe(wait)
+        return task, wait
+
+    def task_started(self, task: Job) -> None:
+        self.running[task.queue] += 1
+
+    def task_stopped(self, task: Job) -> None:
+        self.running[task.queue] -= 1
+
+    def queue_stats(self) -> Dict[str, Dict[str, float]]:
+        """Число готовых и выполняемых задач и время ожидания запуска по очередям"""
+        queues = set(self.queues) | set(self.running) | set(self.stats)
+        result = {}
+        for queue in sorted(queues):
+            stats = self.stats[queue]
+            result[queue] = {
+                "ready": len(self.queues[queue]),
+                "running": self.running[queue],
+                "admitted": stats.admitted,
+                "wait_avg": stats.wait_total / stats.admitted if stats.admitted else 0.0,
+                "wait_max": stats.wait_max,
+            }
+        return result
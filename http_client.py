@@ -0,0 +1,171 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger import logger
+from settings import HTTP_MAX_IN_FLIGHT, HTTP_MAX_REDIRECTS, HTTP_PER_HOST_LIMIT, HTTP_TIMEOUT
+
+HostKey = Tuple[str, str]
+
+
+class HttpGet:
+    """GET-запрос, который шаг задачи отдает общему HTTP-клиенту: `response = yield HttpGet(url)`.
+
+    Результат - requests.Response с прочитанным телом, а с stream=True - открытый Stream,
+    тело которого читается по частям. Статус ответа проверяет задача.
+    """
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, stream=False):
+        self.url = url
+        self.headers = headers or {}
+        self.stream = stream
+
+    def __repr__(self) -> str:
+        return f"HttpGet({self.url})"
+
+
+class Stream:
+    """Ответ, тело которого еще не прочитано. Держит соединение и слот хоста до close()"""
+
+    def __init__(self, response: requests.Response, release: Callable[[], None]):
+        self.response = response
+        self.url = response.url
+        self.status = response.status_code
+        self.headers = response.headers
+        self._release: Optional[Callable[[], None]] = release
+
+    @property
+    def ok(self) -> bool:
+        return self.response.ok
+
+    def read(self, size: Optional[int] = None) -> bytes:
+        """Читает до size байт тела как есть, без распаковки; пустая строка - тело закончилось"""
+        return self.response.raw.read(size)
+
+    def close(self) -> None:
+        if self._release is None:
+            return
+        # прочитанное целиком соединение возвращается в пул, недочитанное закрывается
+        self.response.close()
+        self._release()
+        self._release = None
+
+
+class HttpClient:
+    """Общий HTTP-клиент планировщика поверх одной requests.Session.
+
+    Session держит keep-alive соединения по хостам, учитывает прокси и настройки из окружения
+    и следует редиректам. Клиент ограничивает число одновременных запросов к одному хосту
+    (лишние ждут в очереди хоста, не занимая потоков) и общее число запросов в полете
+    (размер собственного пула потоков).
+    """
+
+    def __init__(self, max_in_flight=HTTP_MAX_IN_FLIGHT, per_host_limit=HTTP_PER_HOST_LIMIT, timeout=HTTP_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.max_redirects = HTTP_MAX_REDIRECTS
+        # соединений к хосту не больше, чем одновременных запросов к нему
+        adapter = HTTPAdapter(pool_connections=max_in_flight, pool_maxsize=per_host_limit, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="http")
+        self._lock = threading.Lock()
+        # занятые слоты и очередь запросов, ждущих слот, по хостам
+        self._active: Dict[HostKey, int] = {}
+        self._queued: Dict[HostKey, Deque[Tuple[HttpGet, Future]]] = {}
+        self._requests = 0
+        # после close() пулы соединений очищены, остается последняя статистика
+        self._closed_stats: Optional[Dict[str, int]] = None
+
+    def submit(self, request: HttpGet) -> Future:
+        """Отправляет запрос, если у хоста есть свободный слот, иначе ставит его в очередь хоста.
+
+        Поток пула не ждет слот: запрос из очереди уходит, когда освобождается слот хоста.
+        """
+        parts = urlsplit(request.url)
+        key = (parts.scheme, parts.netloc)
+        future: Future = Future()
+        with self._lock:
+            if self._active.get(key, 0) >= self.per_host_limit:
+                self._queued.setdefault(key, deque()).append((request, future))
+                return future
+            self._active[key] = self._active.get(key, 0) + 1
+        self.dispatch(key, request, future)
+        return future
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        return self.submit(HttpGet(url, headers)).result()
+
+    def dispatch(self, key: HostKey, request: HttpGet, future: Future) -> None:
+        try:
+            self.executor.submit(self.perform, key, request, future)
+        except RuntimeError as error:
+            # клиент закрыт
+            self.release(key)
+            future.set_exception(error)
+
+    def perform(self, key: HostKey, request: HttpGet, future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            self.release(key)
+            return
+        try:
+            response = self.session.get(request.url, headers=request.headers, stream=True, timeout=self.timeout)
+        except BaseException as error:
+            self.release(key)
+            future.set_exception(error)
+            return
+        with self._lock:
+            self._requests += 1
+        if request.stream:
+            future.set_result(Stream(response, lambda: self.release(key)))
+            return
+        try:
+            response.content
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+        finally:
+            response.close()
+            self.release(key)
+
+    def release(self, key: HostKey) -> None:
+        """Освобождает слот хоста: его сразу занимает следующий запрос из очереди хоста"""
+        with self._lock:
+            queued = self._queued.get(key)
+            if not queued:
+                self._active[key] -= 1
+                return
+            request, future = queued.popleft()
+        self.dispatch(key, request, future)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Число запросов и соединений; соединения считаются по пулам хостов, которые еще открыты"""
+        if self._closed_stats is not None:
+            return self._closed_stats
+        pools = self.session.get_adapter("http://").poolmanager.pools
+        opened = reused = 0
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            reused += pool.num_requests - pool.num_connections
+        return {"requests": self._requests, "connections_opened": opened, "connections_reused": reused}
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+        with self._lock:
+            queued = [future for requests_queue in self._queued.values() for _, future in requests_queue]
+            self._queued.clear()
+        for future in queued:
+            future.cancel()
+        self._closed_stats = self.stats
+        self.session.close()
+        logger.info(f"HTTP client closed, stats: {self._closed_stats}")
@@ -1,19 +1,75 @@
+import hashlib
+import inspect
+import json
+import os
 import pickle
-import uuid
+import zlib
 from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
 
 from logger import logger
-from settings import DONE_TASKS, QUEUED_TASKS_DIR, RUNNING_TASKS_DIR
+
+# где выполняются шаги задачи: в цикле планировщика (None), в пуле потоков или в пуле процессов
+EXECUTORS = (None, "thread", "process")
+DEFAULT_QUEUE = "default"
+
+JobId = int
+
+
+def new_job_id() -> JobId:
+    """Случайный 60-битный идентификатор: помещается в компактный int, а вероятность совпадения
+    даже среди миллионов задач пренебрежимо мала"""
+    return int.from_bytes(os.urandom(8), "little") >> 4
+
+
+@lru_cache(maxsize=None)
+def slot_names(cls: type) -> Tuple[str, ...]:
+    """Все слоты класса задачи с учетом предков, в постоянном порядке"""
+    return tuple(
+        name
+        for klass in reversed(cls.__mro__)
+        for name in getattr(klass, "__slots__", ())
+        if name not in ("__dict__", "__weakref__")
+    )
+
+
+@lru_cache(maxsize=None)
+def state_layout(cls: type) -> int:
+    """Отпечаток имен и порядка слотов класса: сохраняется вместе со значениями слотов"""
+    return zlib.crc32(",".join(slot_names(cls)).encode())
 
 
 class Job:
-    def __init__(self, start_at=None, max_working_time=-1, max_tries=0, dependencies=None):
+    # состояние ядра задачи хранится в слотах; наследники без __slots__ получают __dict__ для своих полей
+    __slots__ = (
+        "start_at", "max_working_time", "max_tries", "tries", "dependencies", "executor", "priority", "queue",
+        "critical_path", "unique_name",
+    )
+    # имена атрибутов с входными данными задачи: если заданы, результат задачи кэшируется по их отпечатку
+    cache_inputs: Tuple[str, ...] = ()
+
+    def __init__(
+        self, start_at=None, max_working_time=-1, max_tries=0, dependencies: Iterable[Union["Job", JobId]] = (),
+        executor=None, priority=0, queue=DEFAULT_QUEUE,
+    ):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}, expected one of {EXECUTORS}")
         self.start_at = start_at or datetime.now()
         self.max_working_time = max_working_time
         self.max_tries = max_tries
         self.tries = 0
-        self.dependencies = dependencies or []
-        self.unique_name = str(uuid.uuid4())
+        # зависимости хранятся идентификаторами, поэтому задача сериализуется без цепочки своих зависимостей
+        self.dependencies: Tuple[JobId, ...] = tuple(
+            dependency if isinstance(dependency, int) else dependency.unique_name for dependency in dependencies or ()
+        )
+        self.executor = executor
+        # чем больше приоритет, тем раньше задача запускается внутри своей очереди (тенанта)
+        self.priority = priority
+        self.queue = queue
+        # длина самой длинной цепочки зависимых задач, начиная с этой (считается в schedule_many)
+        self.critical_path = 1
+        self.unique_name = new_job_id()
 
     def __iter__(self):
         yield from self.run()
@@ -27,19 +83,10 @@ class Job:
         """Необходимо реализовать сброс состояния для ретраев"""
         raise NotImplementedError
 
-    def stop(self, save_data, running) -> None:
-        """Штатная остановка с сохранением всех нужных данных"""
-        if not save_data:
-            logger.info(f"Exit without saving {self.unique_name}")
-            return
-        if running:
-            path_to_save = f"{RUNNING_TASKS_DIR}{self.unique_name}.pkl"
-        else:
-            path_to_save = f"{QUEUED_TASKS_DIR}{self.unique_name}.pkl"
-        logger.info(f"Saving data for task  {self.unique_name}")
-        with open(path_to_save, "wb") as file:
-            pickle.dump(self, file)
-        logger.info(f"Successfully save data for task {self.unique_name}")
+    @property
+    def is_async(self) -> bool:
+        """Задача реализована асинхронным генератором (async def run)"""
+        return inspect.isasyncgenfunction(self.run)
 
     @property
     def is_expired(self) -> bool:
@@ -51,8 +98,57 @@ class Job:
                 return True
         return False
 
-    def save_to_done(self) -> None:
-        """Сохраняет идентификатор задачи в текстовый файл с выполненными задачами"""
+    def __getstate__(self):
+        """Состояние задачи - отпечаток набора слотов, значения слотов по порядку без их имен
+        и __dict__ наследника, если он есть"""
+        cls = type(self)
+        values = tuple(getattr(self, name, None) for name in slot_names(cls))
+        return state_layout(cls), values, getattr(self, "__dict__", None)
+
+    def __setstate__(self, state) -> None:
+        layout, values, attributes = state
+        cls = type(self)
+        if layout != state_layout(cls):
+            # значения слотов сохранены по порядку: с другим набором слотов они попали бы не в те поля
+            raise pickle.UnpicklingError(
+                f"{cls.__qualname__} state was saved with another slot layout, current slots: {slot_names(cls)}"
+            )
+        for name, value in zip(slot_names(cls), values):
+            setattr(self, name, value)
+        if attributes:
+            self.__dict__.update(attributes)
+
+    def update_state(self, other: "Job") -> None:
+        """Переносит состояние копии задачи, например выполненной в пуле процессов"""
+        self.__setstate__(other.__getstate__())
+
+    def fingerprint(self) -> Optional[str]:
+        """Отпечаток класса задачи и ее входных данных, None - задача не кэшируется"""
+        if not self.cache_inputs:
+            return None
+        inputs = {name: getattr(self, name) for name in self.cache_inputs}
+        job_class = f"{type(self).__module__}.{type(self).__qualname__}"
+        payload = json.dumps([job_class, inputs], sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def cached_outputs(self) -> Iterable[str]:
+        """Пути файлов, которые создает задача: результат из кэша используется, только если они существуют"""
+        return ()
+
+    def result_state(self) -> Dict[str, Any]:
+        """Состояние задачи после выполнения без полей ядра (идентификатора, зависимостей, попыток)"""
+        core = set(slot_names(Job))
+        state = {
+            name: getattr(self, name) for name in slot_names(type(self)) if name not in core and hasattr(self, name)
+        }
+        state.update(getattr(self, "__dict__", {}))
+        return state
+
+    def restore_result(self, state: Dict[str, Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def save_to_done(self, done_log) -> None:
+        """Добавляет идентификатор задачи в буфер файла с выполненными задачами"""
         logger.info("Add to done tasks")
-        with open(DONE_TASKS, "a") as file:
-            file.write(self.unique_name + "\n")
+        done_log.append(self.unique_name)
@@ -0,0 +1,317 @@
+import os
+import pickle
+import struct
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from job import Job, JobId
+from logger import logger
+from settings import JOURNAL_COMPACT_EVERY, JOURNAL_FILE, JOURNAL_SNAPSHOT
+
+# события журнала
+SCHEDULE = "schedule"
+START = "start"
+CHECKPOINT = "checkpoint"
+RETRY = "retry"
+DONE = "done"
+FAIL = "fail"
+# события, в которые записывается состояние задачи
+STATEFUL_EVENTS = (SCHEDULE, CHECKPOINT, RETRY)
+
+# статусы живых задач в снапшоте
+QUEUED = "queued"
+RUNNING = "running"
+
+# снапшот заканчивается смещением индекса: 8 байт little-endian
+SNAPSHOT_FOOTER = struct.Struct("<Q")
+# индекс снапшота пишется частями по столько задач, чтобы читать его постепенно
+SNAPSHOT_INDEX_CHUNK = 4096
+
+# поля задачи, нужные очередям до ее запуска
+TaskIndex = Tuple[datetime, Tuple[JobId, ...], int, str, int]
+
+SERIALIZATION_ERRORS = (pickle.PicklingError, TypeError, AttributeError, RecursionError)
+
+
+def task_index(task: Union[Job, "JobStub"]) -> TaskIndex:
+    return task.start_at, tuple(task.dependencies), task.priority, task.queue, task.critical_path
+
+
+def fsync_dir(path: str) -> None:
+    """Сбрасывает на диск запись каталога, чтобы переименование файла в нем пережило сбой"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JobStub:
+    """Легкая ссылка на задачу из журнала: поля индекса для очередей и место ее pickle в файле.
+
+    Задача десериализуется в load(), когда ее пора запускать.
+    """
+
+    __slots__ = (
+        "unique_name", "start_at", "dependencies", "priority", "queue", "critical_path", "source", "offset", "length",
+    )
+
+    def __init__(self, unique_name: JobId, index: TaskIndex, source: BinaryIO, offset: int, length: int):
+        self.unique_name = unique_name
+        self.start_at, self.dependencies, self.priority, self.queue, self.critical_path = index
+        self.source = source
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self) -> str:
+        return f"<JobStub {self.unique_name}>"
+
+    def payload(self) -> bytes:
+        return os.pread(self.source.fileno(), self.length, self.offset)
+
+    def load(self) -> Job:
+        return pickle.loads(self.payload())
+
+
+class Journal:
+    """Журнал планировщика: снапшот живых задач и дописываемый хвост событий после него.
+
+    Восстановление читает снапшот и применяет хвост, поэтому его время зависит от числа живых
+    задач, а не от всей истории: хвост периодически сворачивается в новый снапшот.
+
+    Запись хвоста - заголовок (событие, идентификатор, индекс задачи, длина) и следом pickle задачи.
+    Снапшот - pickle задач подряд, затем частями индекс (статус, идентификатор, индекс задачи,
+    смещение, длина). При восстановлении читаются только заголовки и индекс, задачи
+    возвращаются как JobStub.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, snapshot_path=JOURNAL_SNAPSHOT, compact_every=JOURNAL_COMPACT_EVERY):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.compact_every = compact_every
+        self.records_since_snapshot = 0
+        # задачи, завершение которых найдено в хвосте при восстановлении
+        self.replayed_done: Set[JobId] = set()
+        self._file: Optional[BinaryIO] = None
+        # файлы для чтения, на которые ссылаются JobStub
+        self.sources: List[BinaryIO] = []
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path) or os.path.isfile(self.snapshot_path)
+
+    @property
+    def file(self) -> BinaryIO:
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        return self._file
+
+    @staticmethod
+    def serialize(event: str, task: Job) -> bytes:
+        """Заголовок записи и pickle задачи; сериализуются целиком до записи,
+        чтобы ошибка не оставила в журнале оборванную запись"""
+        if event not in STATEFUL_EVENTS:
+            return pickle.dumps((event, task.unique_name, None, 0))
+        payload = pickle.dumps(task)
+        return pickle.dumps((event, task.unique_name, task_index(task), len(payload))) + payload
+
+    def record(self, event: str, task: Job) -> None:
+        try:
+            data = self.serialize(event, task)
+        except SERIALIZATION_ERRORS:
+            logger.warning(f"Can't serialize task {task.unique_name} for event {event}, it won't survive restart")
+            return
+        self.file.write(data)
+        self.records_since_snapshot += 1
+
+    def checkpoint(self, tasks: Iterable[Job], max_bytes: Optional[int] = None) -> List[JobId]:
+        """Дописывает состояние изменившихся задач одной записью на диск и ждет fsync.
+
+        Записи сериализуются целиком до записи, оборванный при аварии хвост отбрасывается при
+        восстановлении, поэтому каждая задача восстанавливается из своей последней полной записи.
+        Останавливается, когда следующая задача превысит max_bytes; хотя бы одна задача пишется всегда.
+        Возвращает идентификаторы обработанных задач, остальные ждут следующей контрольной точки.
+        """
+        chunks: List[bytes] = []
+        handled: List[JobId] = []
+        size = 0
+        for task in tasks:
+            try:
+                data = self.serialize(CHECKPOINT, task)
+            except SERIALIZATION_ERRORS:
+                logger.warning(f"Can't serialize task {task.unique_name} for checkpoint")
+                handled.append(task.unique_name)
+                continue
+            if max_bytes is not None and chunks and size + len(data) > max_bytes:
+                break
+            chunks.append(data)
+            handled.append(task.unique_name)
+            size += len(data)
+        if chunks:
+            self.file.write(b"".join(chunks))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.records_since_snapshot += len(chunks)
+            logger.debug(f"Checkpoint of {len(chunks)} tasks, {size} bytes")
+        return handled
+
+    def size(self) -> int:
+        """Размер журнала на диске: снапшот и хвост"""
+        self.flush()
+        return sum(os.path.getsize(path) for path in (self.path, self.snapshot_path) if os.path.isfile(path))
+
+    def needs_compaction(self, live_count: int) -> bool:
+        """Свертка окупается, когда хвост длиннее и порога, и самого снапшота"""
+        return self.records_since_snapshot >= max(self.compact_every, live_count)
+
+    def compact(self, live_tasks: Iterable[Tuple[str, Union[Job, JobStub]]]) -> None:
+        """Атомарно записывает снапшот живых задач и обрезает хвост.
+
+        Невосстановленные задачи (JobStub) переносятся байтами без десериализации
+        и после свертки ссылаются на новый снапшот.
+        """
+        tmp_path = f"{self.snapshot_path}.tmp"
+        index = []
+        stubs = []
+        try:
+            with open(tmp_path, "wb") as file:
+                for status, task in live_tasks:
+                    if isinstance(task, JobStub):
+                        payload = task.payload()
+                        stubs.append((task, file.tell()))
+                    else:
+                        payload = pickle.dumps(task)
+                    index.append((status, task.unique_name, task_index(task), file.tell(), len(payload)))
+                    file.write(payload)
+                index_offset = file.tell()
+                for start in range(0, len(index), SNAPSHOT_INDEX_CHUNK):
+                    pickle.dump(index[start:start + SNAPSHOT_INDEX_CHUNK], file)
+                file.write(SNAPSHOT_FOOTER.pack(index_offset))
+                # снапшот должен лежать на диске до того, как заменит старый и обрежет хвост
+                file.flush()
+                os.fsync(file.fileno())
+        except SERIALIZATION_ERRORS:
+            logger.error("Can't serialize journal snapshot, keep the tail", exc_info=True)
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self.snapshot_path)
+        fsync_dir(os.path.dirname(os.path.abspath(self.snapshot_path)))
+        # старые снапшот и хвост больше не нужны ни одной задаче
+        source = open(self.snapshot_path, "rb")
+        for stub, offset in stubs:
+            stub.source, stub.offset = source, offset
+        self.close_sources()
+        self.sources.append(source)
+        self.close()
+        with open(self.path, "wb"):
+            pass
+        logger.info(f"Journal compacted after {self.records_since_snapshot} records")
+        self.records_since_snapshot = 0
+
+    def replay(self) -> Iterator[Tuple[str, JobStub]]:
+        """Восстанавливает индекс живых задач со статусами из снапшота и хвоста журнала.
+
+        Хвост читается сразу, в том числе завершения задач в replayed_done. Индекс снапшота
+        читается частями по мере обхода итератора, поэтому задачи можно ставить в очереди,
+        не дожидаясь чтения всего индекса.
+        """
+        self.records_since_snapshot = 0
+        # изменения из хвоста: идентификатор -> [статус, задача, запланирована в хвосте] или None, если завершена
+        changes: Dict[JobId, Optional[list]] = {}
+        if os.path.isfile(self.path):
+            source = open(self.path, "rb")
+            self.sources.append(source)
+            for event, unique_name, stub in self.read_records(source):
+                self.apply(changes, event, unique_name, stub)
+                if event == DONE:
+                    self.replayed_done.add(unique_name)
+                self.records_since_snapshot += 1
+        return self.live_entries(changes)
+
+    def live_entries(self, changes: Dict[JobId, Optional[list]]) -> Iterator[Tuple[str, JobStub]]:
+        restored = 0
+        for status, stub in self.snapshot_entries():
+            if stub.unique_name in changes:
+                change = changes.pop(stub.unique_name)
+                if change is None:
+                    continue
+                status, stub = change[0] or status, change[1] or stub
+            restored += 1
+            yield status, stub
+        for change in changes.values():
+            if change is not None and change[2]:
+                restored += 1
+                yield change[0], change[1]
+        logger.info(f"Restore {restored} tasks from journal, tail {self.records_since_snapshot} records")
+
+    def snapshot_entries(self) -> Iterator[Tuple[str, JobStub]]:
+        if not os.path.isfile(self.snapshot_path):
+            return
+        source = open(self.snapshot_path, "rb")
+        self.sources.append(source)
+        index_end = source.seek(-SNAPSHOT_FOOTER.size, os.SEEK_END)
+        index_offset, = SNAPSHOT_FOOTER.unpack(source.read(SNAPSHOT_FOOTER.size))
+        # индекс читается через отдельный дескриптор, source нужен JobStub для pread
+        with open(self.snapshot_path, "rb") as file:
+            file.seek(index_offset)
+            while file.tell() < index_end:
+                for status, unique_name, index, offset, length in pickle.load(file):
+                    yield status, JobStub(unique_name, index, source, offset, length)
+
+    @staticmethod
+    def read_records(file: BinaryIO) -> Iterable[Tuple[str, JobId, Optional[JobStub]]]:
+        """Читает заголовки записей, pickle задач пропускаются"""
+        size = os.fstat(file.fileno()).st_size
+        while True:
+            try:
+                event, unique_name, index, length = pickle.load(file)
+            except EOFError:
+                return
+            except (pickle.UnpicklingError, ValueError, AttributeError):
+                # запись, оборванная при аварийном завершении, считается концом журнала
+                logger.warning("Journal tail is truncated, ignore the last record")
+                return
+            offset = file.tell()
+            if offset + length > size:
+                logger.warning("Journal tail is truncated, ignore the last record")
+                return
+            file.seek(length, os.SEEK_CUR)
+            yield event, unique_name, JobStub(unique_name, index, file, offset, length) if index else None
+
+    @staticmethod
+    def apply(changes: Dict[JobId, Optional[list]], event: str, unique_name: JobId,
+              stub: Optional[JobStub]) -> None:
+        if event in (DONE, FAIL):
+            changes[unique_name] = None
+        elif event == SCHEDULE:
+            changes[unique_name] = [QUEUED, stub, True]
+        else:
+            if unique_name not in changes:
+                changes[unique_name] = [None, None, False]
+            change = changes[unique_name]
+            if change is None:
+                return
+            if event in (START, RETRY):
+                change[0] = RUNNING
+            change[1] = stub or change[1]
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close_sources(self) -> None:
+        for source in self.sources:
+            source.close()
+        self.sources.clear()
+
+    def clear(self) -> None:
+        self.close()
+        self.close_sources()
+        for path in (self.path, self.snapshot_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        self.records_since_snapshot = 0
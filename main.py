@@ -1,16 +1,18 @@
 import os
 import time
+from concurrent.futures import Future
 from copy import copy
 from datetime import datetime, timedelta
-from typing import List
+from typing import Dict, List
 from urllib.parse import urlparse
 
-import requests
-
 from exceptions import TaskError
+from http_client import HttpGet, Stream
 from job import Job
 from logger import logger
+from offload import AnyOf, Blocking
 from scheduler import Scheduler
+from settings import HTTP_CHUNK_SIZE, HTTP_JOB_FANOUT
 
 
 class TestTask(Job):
@@ -56,6 +58,8 @@ class TestTask(Job):
 
 
 class CreateNewDirsTask(Job):
+    cache_inputs = ("new_dirs_dump",)
+
     def __init__(self, new_dirs: List[str], *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.new_dirs = copy(new_dirs)
@@ -68,11 +72,16 @@ class CreateNewDirsTask(Job):
             logger.info(f"Dir created: {new_dir}")
             yield self
 
+    def cached_outputs(self):
+        return self.new_dirs_dump
+
     def reset(self):
         self.new_dirs = copy(self.new_dirs_dump)
 
 
 class CreateNewFilesTask(Job):
+    cache_inputs = ("dirs_to_create_file_dump",)
+
     def __init__(self, dirs_to_create_file: List[str], *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dirs_to_create_file = copy(dirs_to_create_file)
@@ -86,32 +95,121 @@ class CreateNewFilesTask(Job):
             logger.info(f"File created: {file_path}")
             yield self
 
+    def cached_outputs(self):
+        return [f"{directory}/testfile.txt" for directory in self.dirs_to_create_file_dump]
+
     def reset(self):
         self.dirs_to_create_file = copy(self.dirs_to_create_file_dump)
 
 
 class SaveWebPagesTask(Job):
-    def __init__(self, urls: List[str], *args, **kwargs):
+    cache_inputs = ("urls_dump", "output_dir")
+
+    def __init__(self, urls: List[str], output_dir=".", *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.urls = copy(urls)
         self.urls_dump = copy(urls)
+        self.output_dir = output_dir
+        # файл и число уже записанных байт по каждой начатой загрузке, чтобы продолжить ее после рестарта
+        self.filenames: Dict[str, str] = {}
+        self.offsets: Dict[str, int] = {}
 
     def run(self):
-        for _ in range(len(self.urls)):
-            yield self
-            url = self.urls.pop()
-            response = requests.get(url)
-            parsed_url = urlparse(url)
-            hostname = parsed_url.netloc
-            timestamp = time.time()
-            filename = f"{hostname}_{timestamp}.txt"
-            with open(filename, "wb") as file:
-                file.write(response.content)
-            logger.info(f"File created: {filename}")
-            yield self
+        # URL -> [генератор загрузки, работа, результата которой он ждет]
+        downloads: Dict[str, list] = {}
+        waiting = None
+        try:
+            while self.urls or downloads:
+                for url in self.urls:
+                    if len(downloads) >= HTTP_JOB_FANOUT:
+                        break
+                    if url not in downloads:
+                        download = self.download(url)
+                        downloads[url] = [download, next(download)]
+                waiting = AnyOf([work for _, work in downloads.values()])
+                futures = yield waiting
+                waiting = None
+                for (url, entry), future in zip(list(downloads.items()), futures):
+                    if not future.done():
+                        entry[1] = future
+                        continue
+                    try:
+                        error = future.exception()
+                        entry[1] = entry[0].send(future.result()) if error is None else entry[0].throw(error)
+                    except StopIteration:
+                        del downloads[url]
+                        # сохраненная страница больше не запрашивается после восстановления
+                        self.urls.remove(url)
+                yield self
+        finally:
+            # задача прервана: отправленные работы есть только у AnyOf, которого она ждала
+            works = [work for _, work in downloads.values()]
+            if waiting is not None and waiting.futures:
+                works = waiting.futures
+            for (download, _), work in zip(downloads.values(), works):
+                self.abandon_download(download, work)
+
+    @staticmethod
+    def abandon_download(download, work) -> None:
+        """Закрывает прерванную загрузку; если ее работа еще выполняется, то после ее завершения"""
+        if isinstance(work, Future) and not work.done():
+            work.add_done_callback(lambda _: SaveWebPagesTask.abandon_download(download, work))
+            return
+        # открытый ответ, который загрузка еще не получила, держит слот хоста
+        if isinstance(work, Future) and not work.cancelled() and work.exception() is None:
+            if isinstance(work.result(), Stream):
+                work.result().close()
+        download.close()
+
+    def download(self, url: str):
+        """Пишет тело ответа в файл по частям, между частями отдавая управление планировщику"""
+        hostname = urlparse(url).netloc
+        if url not in self.filenames:
+            # загрузки идут одновременно, номер делает имена различными при совпадении времени
+            name = f"{hostname}_{time.time()}_{len(self.filenames)}.txt"
+            self.filenames[url] = os.path.join(self.output_dir, name)
+        filename = self.filenames[url]
+        # в файле могло не оказаться части, записанной до аварийного завершения
+        offset = min(self.offsets.get(url, 0), os.path.getsize(filename) if os.path.exists(filename) else 0)
+        # тело пишется в файл как есть, поэтому без сжатия
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        stream = yield HttpGet(url, headers, stream=True)
+        try:
+            content_range = stream.headers.get("Content-Range", "").strip()
+            if stream.status == 416 and offset and content_range == f"bytes */{offset}":
+                logger.info(f"File is already complete: {filename}")
+                return
+            # ответ с ошибкой не трогает уже загруженную часть файла
+            if stream.status not in (200, 206):
+                raise TaskError(f"GET {url}: HTTP {stream.status}")
+            if stream.status == 200:
+                # сервер не поддерживает Range, загружаем заново
+                offset = 0
+            elif not content_range.startswith(f"bytes {offset}-"):
+                raise TaskError(f"GET {url}: unexpected Content-Range {content_range!r} for offset {offset}")
+            with open(filename, "r+b" if offset else "wb") as file:
+                file.truncate(offset)
+                file.seek(offset)
+                while True:
+                    chunk = yield Blocking(stream.read, HTTP_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    file.write(chunk)
+                    offset += len(chunk)
+                    self.offsets[url] = offset
+        finally:
+            stream.close()
+        logger.info(f"File created: {filename}")
+
+    def cached_outputs(self):
+        return self.filenames.values()
 
     def reset(self):
         self.urls = copy(self.urls_dump)
+        # файлы остаются прежними: новая попытка перезаписывает их с начала, а не создает новые
+        self.offsets = {}
 
 
 if __name__ == "__main__":
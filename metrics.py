@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, DefaultDict, Dict, List, Optional, Sequence, Tuple
+
+from logger import logger
+from settings import METRICS_FILE, METRICS_FILE_INTERVAL, METRICS_HTTP_PORT
+
+STEP_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0, 60.0, 600.0, 3600.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как в Prometheus"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class NullMetrics:
+    """Метрики выключены: все вызовы ничего не делают"""
+
+    enabled = False
+
+    def observe_queue_wait(self, task) -> None:
+        pass
+
+    def observe_admission_wait(self, queue: str, seconds: float) -> None:
+        pass
+
+    def observe_step(self, task, seconds: float) -> None:
+        pass
+
+    def inc(self, name: str, task) -> None:
+        pass
+
+    def observe_tick(self, seconds: float) -> None:
+        pass
+
+    def add_idle(self, seconds: float) -> None:
+        pass
+
+    def open(self) -> None:
+        pass
+
+    def export(self, force=False) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class Metrics(NullMetrics):
+    """Метрики планировщика с выгрузкой в текстовом формате Prometheus по HTTP или в файл"""
+
+    enabled = True
+
+    def __init__(
+        self,
+        status: Callable[[], Dict],
+        http_port: Optional[int] = METRICS_HTTP_PORT,
+        file_path: Optional[str] = METRICS_FILE,
+        file_interval: float = METRICS_FILE_INTERVAL,
+    ):
+        self.status = status
+        self.http_port = http_port
+        self.file_path = file_path
+        self.file_interval = file_interval
+        self._lock = threading.Lock()
+        self.queue_wait: DefaultDict[str, Histogram] = defaultdict(lambda: Histogram(QUEUE_WAIT_BUCKETS))
+        self.steps: DefaultDict[str, Histogram] = defaultdict(lambda: Histogram(STEP_BUCKETS))
+        # время от готовности задачи до запуска по очередям справедливого распределения
+        self.admission_wait: DefaultDict[str, Histogram] = defaultdict(lambda: Histogram(QUEUE_WAIT_BUCKETS))
+        # счетчики событий задач: (имя, класс задачи) -> значение
+        self.counters: DefaultDict[Tuple[str, str], int] = defaultdict(int)
+        self.ticks = Histogram(STEP_BUCKETS)
+        self.idle_seconds = 0.0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._last_export = time.monotonic()
+
+    def observe_queue_wait(self, task) -> None:
+        """Время от наступления start_at до запуска задачи в пуле"""
+        wait = max(time.time() - task.start_at.timestamp(), 0.0)
+        with self._lock:
+            self.queue_wait[type(task).__name__].observe(wait)
+
+    def observe_admission_wait(self, queue: str, seconds: float) -> None:
+        with self._lock:
+            self.admission_wait[queue].observe(seconds)
+
+    def observe_step(self, task, seconds: float) -> None:
+        with self._lock:
+            self.steps[type(task).__name__].observe(seconds)
+
+    def inc(self, name: str, task) -> None:
+        with self._lock:
+            self.counters[(name, type(task).__name__)] += 1
+
+    def observe_tick(self, seconds: float) -> None:
+        with self._lock:
+            self.ticks.observe(seconds)
+
+    def add_idle(self, seconds: float) -> None:
+        with self._lock:
+            self.idle_seconds += seconds
+
+    def render(self) -> str:
+        status = self.status()
+        lines = ["# TYPE scheduler_tasks gauge"]
+        lines.extend(
+            f'scheduler_tasks{{state="{state}"}} {value}' for state, value in status.items() if isinstance(value, int)
+        )
+        lines.extend(render_queues(status.get("queues", {})))
+        if "offload" in status:
+            lines.extend(render_offload(status["offload"]))
+        if "result_cache" in status:
+            lines.extend(render_result_cache(status["result_cache"]))
+        with self._lock:
+            for name, histograms in (
+                ("scheduler_queue_wait_seconds", self.queue_wait),
+                ("scheduler_step_duration_seconds", self.steps),
+            ):
+                lines.append(f"# TYPE {name} histogram")
+                for job_class, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.render(name, f'job_class="{job_class}"'))
+            lines.append("# TYPE scheduler_admission_wait_seconds histogram")
+            for queue, histogram in sorted(self.admission_wait.items()):
+                lines.extend(histogram.render("scheduler_admission_wait_seconds", f'queue="{queue}"'))
+            counter_names = sorted({name for name, _ in self.counters})
+            for name in counter_names:
+                lines.append(f"# TYPE scheduler_{name}_total counter")
+                lines.extend(
+                    f'scheduler_{name}_total{{job_class="{job_class}"}} {value}'
+                    for (counter_name, job_class), value in sorted(self.counters.items())
+                    if counter_name == name
+                )
+            lines.append("# TYPE scheduler_tick_duration_seconds histogram")
+            lines.extend(self.ticks.render("scheduler_tick_duration_seconds", ""))
+            lines.append("# TYPE scheduler_idle_seconds_total counter")
+            lines.append(f"scheduler_idle_seconds_total {self.idle_seconds}")
+        return "\n".join(lines) + "\n"
+
+    def open(self) -> None:
+        if self.http_port is None or self._server is not None:
+            return
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.http_port), MetricsRequestHandler)
+        self._server.metrics = self  # type: ignore[attr-defined]
+        threading.Thread(target=self._server.serve_forever, name="scheduler-metrics", daemon=True).start()
+        logger.info(f"Metrics are served on http://127.0.0.1:{self._server.server_port}/metrics")
+
+    def export(self, force=False) -> None:
+        """Пишет метрики в файл не чаще, чем раз в file_interval секунд"""
+        if self.file_path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_export < self.file_interval:
+            return
+        self._last_export = now
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.render())
+        os.replace(tmp_path, self.file_path)
+
+    def close(self) -> None:
+        self.export(force=True)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def render_queues(queues: Dict[str, Dict[str, float]]) -> List[str]:
+    """Готовые и выполняемые задачи, число запусков и ожидание запуска по очередям справедливого распределения"""
+    lines = []
+    for name, key, metric_type in (
+        ("scheduler_queue_ready", "ready", "gauge"),
+        ("scheduler_queue_running", "running", "gauge"),
+        ("scheduler_queue_admitted_total", "admitted", "counter"),
+        ("scheduler_queue_wait_avg_seconds", "wait_avg", "gauge"),
+        ("scheduler_queue_wait_max_seconds", "wait_max", "gauge"),
+    ):
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f'{name}{{queue="{queue}"}} {stats[key]}' for queue, stats in queues.items())
+    return lines
+
+
+def render_offload(stats: Dict[str, int]) -> List[str]:
+    """Загрузка пула блокирующих работ: очередь, активные работы и насыщение"""
+    return [
+        "# TYPE scheduler_offload_workers gauge",
+        f"scheduler_offload_workers {stats['max_workers']}",
+        "# TYPE scheduler_offload_active gauge",
+        f"scheduler_offload_active {stats['active']}",
+        "# TYPE scheduler_offload_queue_depth gauge",
+        f"scheduler_offload_queue_depth {stats['queued']}",
+        "# TYPE scheduler_offload_saturated gauge",
+        f"scheduler_offload_saturated {stats['saturated']}",
+        "# TYPE scheduler_offload_completed_total counter",
+        f"scheduler_offload_completed_total {stats['completed']}",
+    ]
+
+
+def render_result_cache(stats: Dict[str, float]) -> List[str]:
+    """Попадания и промахи кэша результатов по проверенным результатам и доля попаданий"""
+    return [
+        "# TYPE scheduler_result_cache_hits_total counter",
+        f"scheduler_result_cache_hits_total {stats['hits']}",
+        "# TYPE scheduler_result_cache_misses_total counter",
+        f"scheduler_result_cache_misses_total {stats['misses']}",
+        "# TYPE scheduler_result_cache_hit_ratio gauge",
+        f"scheduler_result_cache_hit_ratio {stats['hit_rate']}",
+        "# TYPE scheduler_result_cache_entries gauge",
+        f"scheduler_result_cache_entries {stats['entries']}",
+        "# TYPE scheduler_result_cache_bytes gauge",
+        f"scheduler_result_cache_bytes {stats['bytes']}",
+    ]
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()  # type: ignore[attr-defined]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        logger.debug(format % args)
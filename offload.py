@@ -0,0 +1,204 @@
+import concurrent.futures
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from http_client import HttpClient, HttpGet
+from logger import logger
+from settings import OFFLOAD_POOL_SIZE
+
+
+class Blocking:
+    """Блокирующая работа, которую шаг задачи отдает в пул потоков: `result = yield Blocking(func, *args)`"""
+
+    def __init__(self, func: Callable, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self) -> Any:
+        return self.func(*self.args, **self.kwargs)
+
+    def __repr__(self) -> str:
+        return f"Blocking({getattr(self.func, '__name__', self.func)})"
+
+
+class AnyOf:
+    """Несколько работ, задача продолжает, как только завершилась любая из них:
+    `futures = yield AnyOf([HttpGet(url), future, ...])`.
+
+    Результат - список Future в порядке работ; незавершенные можно снова отдать в следующем AnyOf.
+    Планировщик сохраняет этот список и в futures, чтобы прерванная задача могла закрыть начатые работы.
+    """
+
+    def __init__(self, items: List):
+        self.items = items
+        self.futures: List[Future] = []
+
+    def __repr__(self) -> str:
+        return f"AnyOf({len(self.items)})"
+
+
+# работа, которую шаг задачи может отдать планировщику или рабочему потоку
+WORK_TYPES = (Blocking, HttpGet, Future)
+
+
+class OffloadPool:
+    """Общий ограниченный пул потоков для блокирующих шагов задач с учетом очереди и загрузки"""
+
+    def __init__(self, max_workers: int = OFFLOAD_POOL_SIZE):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="offload")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.active = 0
+        self.completed = 0
+
+    def submit(self, work: Blocking) -> Future:
+        with self._lock:
+            self.submitted += 1
+        future = self.executor.submit(self._call, work)
+        if self.is_saturated:
+            logger.debug(f"Offload pool is saturated: {self.stats()}")
+        return future
+
+    def _call(self, work: Blocking) -> Any:
+        with self._lock:
+            self.active += 1
+        try:
+            return work()
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество отправленных, но еще не начатых работ"""
+        return self.submitted - self.completed - self.active
+
+    @property
+    def is_saturated(self) -> bool:
+        return self.submitted - self.completed >= self.max_workers
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_workers": self.max_workers,
+            "active": self.active,
+            "queued": self.queue_depth,
+            "completed": self.completed,
+            "saturated": int(self.is_saturated),
+        }
+
+    def shutdown(self) -> None:
+        logger.info(f"Shutdown offload pool, stats: {self.stats()}")
+        self.executor.shutdown(wait=False)
+
+
+def gather_futures(futures: List[Future]) -> Future:
+    """Объединяет несколько работ в одну: результат - список результатов в исходном порядке
+    или первое исключение, когда завершились все работы"""
+    combined: Future = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_: Future) -> None:
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            combined.set_exception(errors[0])
+        else:
+            combined.set_result([future.result() for future in futures])
+
+    if not futures:
+        combined.set_result([])
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+def first_completed(futures: List[Future]) -> Future:
+    """Future, который завершается списком futures, как только завершилась любая из работ"""
+    combined: Future = Future()
+    lock = threading.Lock()
+
+    def on_done(_: Future) -> None:
+        with lock:
+            if combined.done():
+                return
+            combined.set_result(futures)
+
+    if not futures:
+        combined.set_result([])
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+def run_job_steps(job) -> Tuple[int, Any]:
+    """Выполняет все шаги задачи в рабочем потоке или процессе.
+
+    Работа, которую отдают шаги, выполняется отсюда так же, как в цикле планировщика: Blocking
+    на месте, HttpGet через HTTP-клиент рабочего процесса, списки и AnyOf из них. Результат или
+    исключение работы передаются в задачу. Возвращает число шагов и задачу с новым состоянием,
+    чтобы планировщик перенес его в свой экземпляр.
+    """
+    steps = 0
+    steps_iterator = iter(job)
+    future = None
+    while True:
+        try:
+            if future is None:
+                value = next(steps_iterator)
+            elif future.exception() is not None:
+                value = steps_iterator.throw(future.exception())
+            else:
+                value = steps_iterator.send(future.result())
+        except StopIteration:
+            return steps, job
+        steps += 1
+        future = wait_work(value)
+
+
+def wait_work(value) -> Optional[Future]:
+    """Выполняет работу, которую отдал шаг задачи, и возвращает завершенный Future; None - шаг ничего не отдал"""
+    if isinstance(value, AnyOf):
+        value.futures = [submit_work(item) for item in value.items]
+        future = first_completed(value.futures)
+    elif isinstance(value, list) and value and all(isinstance(item, WORK_TYPES) for item in value):
+        future = gather_futures([submit_work(item) for item in value])
+    elif isinstance(value, WORK_TYPES):
+        future = submit_work(value)
+    else:
+        return None
+    concurrent.futures.wait([future])
+    return future
+
+
+def submit_work(work) -> Future:
+    if isinstance(work, Future):
+        return work
+    if isinstance(work, HttpGet):
+        return worker_http_client().submit(work)
+    future: Future = Future()
+    try:
+        future.set_result(work())
+    except Exception as error:
+        future.set_exception(error)
+    return future
+
+
+_http_client: Optional[HttpClient] = None
+_http_client_lock = threading.Lock()
+
+
+def worker_http_client() -> HttpClient:
+    """HTTP-клиент для задач, которые выполняются в пуле: один на процесс"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+        return _http_client
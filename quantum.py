@@ -0,0 +1,34 @@
+from typing import Dict
+
+from settings import STEP_QUANTUM_MAX_STEPS, STEP_QUANTUM_US
+
+# вес нового замера в скользящем среднем длительности шага
+SMOOTHING = 0.2
+
+
+class StepQuantum:
+    """Квант выполнения задачи за один оборот пула.
+
+    Задача делает шаги подряд, пока не исчерпает max_steps шагов или бюджет времени. Число шагов
+    подстраивается под класс задачи по скользящему среднему длительности шага: следующий шаг
+    делается, только если по оценке он уложится в бюджет. Так задача с короткими шагами не платит
+    за оборот цикла на каждом yield, а остальные задачи ждут не дольше бюджета на каждую из них.
+    """
+
+    def __init__(self, max_steps: int = STEP_QUANTUM_MAX_STEPS, budget_us: float = STEP_QUANTUM_US):
+        self.max_steps = max_steps
+        self.budget = budget_us / 1_000_000
+        self.step_seconds: Dict[str, float] = {}
+
+    def steps_for(self, job_class: str) -> int:
+        """Сколько шагов задача этого класса может сделать за квант"""
+        estimate = self.step_seconds.get(job_class)
+        if not estimate:
+            # первый квант класса - по бюджету времени
+            return self.max_steps
+        return max(1, min(self.max_steps, int(self.budget / estimate)))
+
+    def observe(self, job_class: str, steps: int, seconds: float) -> None:
+        step = seconds / steps
+        previous = self.step_seconds.get(job_class)
+        self.step_seconds[job_class] = step if previous is None else previous + SMOOTHING * (step - previous)
@@ -0,0 +1,116 @@
+import os
+import pickle
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from logger import logger
+from settings import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL
+
+
+class ResultCache:
+    """Локальный кэш результатов задач с адресацией по отпечатку входных данных.
+
+    Запись - файл <каталог>/<первые 2 символа>/<отпечаток>. Время изменения файла - время записи
+    для TTL, время доступа обновляется при попадании и задает порядок вытеснения LRU, когда
+    суммарный размер превышает max_bytes.
+    """
+
+    def __init__(self, path=RESULT_CACHE_DIR, ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "stored": 0}
+        # отпечаток -> (размер, время последнего доступа)
+        self.entries: Dict[str, Tuple[int, float]] = self.scan()
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+
+    def scan(self) -> Dict[str, Tuple[int, float]]:
+        entries = {}
+        if not os.path.isdir(self.path):
+            return entries
+        for prefix in os.listdir(self.path):
+            directory = os.path.join(self.path, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(directory, name))
+                entries[name] = (stat.st_size, stat.st_atime)
+        return entries
+
+    def entry_path(self, fingerprint: str) -> str:
+        return os.path.join(self.path, fingerprint[:2], fingerprint)
+
+    def get(self, fingerprint: str) -> Optional[Any]:
+        """Запись по отпечатку; попадание или промах учитывает record_lookup, когда результат проверен"""
+        path = self.entry_path(fingerprint)
+        if fingerprint not in self.entries:
+            return None
+        now = time.time()
+        try:
+            written_at = os.path.getmtime(path)
+            if now - written_at > self.ttl:
+                self.stats["expired"] += 1
+                raise LookupError
+            with open(path, "rb") as file:
+                result = pickle.load(file)
+        except (LookupError, OSError, pickle.UnpicklingError, EOFError):
+            # устаревшая, удаленная или поврежденная запись
+            self.remove(fingerprint)
+            return None
+        os.utime(path, (now, written_at))
+        self.entries[fingerprint] = (self.entries[fingerprint][0], now)
+        return result
+
+    def record_lookup(self, hit: bool) -> None:
+        self.stats["hits" if hit else "misses"] += 1
+
+    def put(self, fingerprint: str, result: Any) -> None:
+        try:
+            data = pickle.dumps(result)
+        except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+            logger.warning(f"Can't serialize result {fingerprint}, it won't be cached")
+            return
+        if len(data) > self.max_bytes:
+            return
+        path = self.entry_path(fingerprint)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+        if fingerprint in self.entries:
+            self.total_bytes -= self.entries[fingerprint][0]
+        self.entries[fingerprint] = (len(data), time.time())
+        self.total_bytes += len(data)
+        self.stats["stored"] += 1
+        self.evict()
+
+    def evict(self) -> None:
+        """Удаляет давно не использованные записи, пока кэш больше max_bytes"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        for fingerprint, _ in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            self.remove(fingerprint)
+            self.stats["evicted"] += 1
+            if self.total_bytes <= self.max_bytes:
+                return
+
+    def remove(self, fingerprint: str) -> None:
+        size, _ = self.entries.pop(fingerprint)
+        self.total_bytes -= size
+        path = self.entry_path(fingerprint)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def status(self) -> Dict[str, float]:
+        return {**self.stats, "hit_rate": self.hit_rate, "entries": len(self.entries), "bytes": self.total_bytes}
+
+    def close(self) -> None:
+        logger.info(f"Result cache hit rate {self.hit_rate:.0%}, stats: {self.stats}")
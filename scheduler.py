@@ -1,176 +1,681 @@
-import json
+import copy
+import heapq
+import itertools
 import os
+import threading
 import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, Iterator, List
+from typing import DefaultDict, Deque, Dict, Generator, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
-from exceptions import StopEventLoop, TaskError
-from job import Job
+from artifacts import artifacts
+from control import SchedulerControl
+from dag import plan_pipeline
+from done_log import DoneLog
+from exceptions import DependencyError, StopEventLoop, TaskError
+from fair_queue import FairQueue
+from http_client import HttpClient, HttpGet
+from job import Job, JobId
+from journal import DONE, FAIL, QUEUED, RETRY, RUNNING, SCHEDULE, START, JobStub, Journal
 from logger import logger
-from settings import CONDITION_CACHE, DONE_TASKS, POOL_SIZE, QUEUED_TASKS_DIR, RUNNING_TASKS_DIR, SCHEDULER_DATA
-from utils import check_tasks_is_completed, delete_files_in_dir, get_pickled_tasks
+from metrics import Metrics, NullMetrics
+from offload import WORK_TYPES, AnyOf, Blocking, OffloadPool, first_completed, gather_futures, run_job_steps
+from quantum import StepQuantum
+from result_cache import ResultCache
+from settings import (
+    CHECKPOINT_INTERVAL, CHECKPOINT_MAX_BYTES, CONTROL_SOCKET, JOURNAL_RESTORE_BATCH, METRICS_ENABLED, POOL_SIZE,
+    PROCESS_POOL_SIZE, PROFILE_JOB_CLASSES, TRACE_FILE,
+)
+from tracing import NullTracer, Tracer
+from utils import load_done_tasks
 
 
 class Scheduler:
-    def __init__(self):
-        self.init_dirs()
-        self.tasks: List[Job] = []
-        self.running_tasks: List[Iterator] = []
+    def __init__(self, pool_size: int = POOL_SIZE):
+        # сколько задач выполняется одновременно
+        self.pool_size = pool_size
+        self.journal = Journal()
+        self.artifacts = artifacts
+        self.done_log = DoneLog()
+        # отложенные задачи: куча (start_at, порядковый номер, задача)
+        self.delayed_tasks: List[Tuple[datetime, int, Job]] = []
+        # задачи, время запуска которых уже наступило, по очередям с приоритетами
+        self.ready_tasks = FairQueue()
+        # задачи, ожидающие завершения зависимостей, и число незавершенных зависимостей у каждой
+        self.waiting_tasks: Dict[JobId, Job] = {}
+        self.pending_dependencies: Dict[JobId, int] = {}
+        # обратные ребра графа: идентификатор зависимости -> зависящие от нее задачи
+        self.dependents: DefaultDict[JobId, List[Job]] = defaultdict(list)
+        self.done_tasks: Set[JobId] = set()
+        # пул выполняемых задач: очередь итераторов, которые продвигаются по кругу
+        self.running_tasks: Deque[Iterator] = deque()
         self.tasks_mapping: Dict[Iterator, Job] = {}
+        # задачи, ожидающие результата блокирующей работы из пула потоков
+        self.parked_tasks: Dict[Iterator, Future] = {}
+        # задачи из журнала, которые еще не поставлены в очереди, None - восстановление завершено
+        self.restoring: Optional[Iterator[Tuple[str, JobStub]]] = None
+        # задачи, состояние которых изменилось после последней контрольной точки, в порядке первого изменения
+        self.dirty_tasks: Dict[JobId, Job] = {}
+        self._last_checkpoint = time.monotonic()
+        self._offload_pool: Optional[OffloadPool] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._http_client: Optional[HttpClient] = None
+        self._result_cache: Optional[ResultCache] = None
+        self.quantum = StepQuantum()
+        self._sequence = itertools.count()
+        self._wakeup = threading.Event()
+        self.control = SchedulerControl(wakeup=self.wake, status=self.status)
+        self.metrics = Metrics(status=self.status) if METRICS_ENABLED else NullMetrics()
+        self.tracer = Tracer() if TRACE_FILE or PROFILE_JOB_CLASSES else NullTracer()
         if self.is_resume_after_stop():
-            self.init_from_file()
+            self.init_from_journal()
         else:
             # перезаписать файл с выполненными задачами
             self.create_done_list()
 
-    def init_from_file(self):
-        logger.info("Start init from file}")
-        self.tasks = get_pickled_tasks(from_dir=QUEUED_TASKS_DIR)
-        self.running_tasks = get_pickled_tasks(from_dir=RUNNING_TASKS_DIR)
+    def init_from_journal(self):
+        logger.info("Start init from journal")
+        self.done_tasks = load_done_tasks()
+        self.restoring = self.journal.replay()
+        # завершения из журнала, которые могли не успеть попасть в файл выполненных задач
+        self.done_tasks.update(self.journal.replayed_done)
+        # читатели буферов становятся известны по мере восстановления очереди
+        self.artifacts.defer_removal()
+        self.restore_batch()
         logger.info("Init successfull")
-        logger.debug(f"tasks: {self.tasks}")
+        logger.debug(f"delayed_tasks: {self.delayed_tasks}")
+        logger.debug(f"ready_tasks: {self.ready_tasks}")
         logger.debug(f"running_tasks: {self.running_tasks}")
 
+    def restore_batch(self, size: int = JOURNAL_RESTORE_BATCH) -> None:
+        """Ставит в очереди следующую часть задач из журнала.
+
+        В очереди попадает только индекс задачи (JobStub), задача целиком читается из журнала
+        при запуске. Так первый шаг после рестарта не ждет восстановления всей очереди.
+        """
+        if self.restoring is None:
+            return
+        now = datetime.now()
+        restored = 0
+        for status, stub in itertools.islice(self.restoring, size):
+            restored += 1
+            if status != RUNNING:
+                self.queue_task(stub, now)
+                continue
+            self.artifacts.add_reader(stub.dependencies)
+            task = self.load_task(stub)
+            if task is not None:
+                self.start_task(task)
+        if restored < size:
+            self.restoring = None
+            self.artifacts.resume_removal()
+
+    def restore_all(self) -> None:
+        while self.restoring is not None:
+            self.restore_batch()
+
+    def schedule(self, task: Job) -> None:
+        self.journal.record(SCHEDULE, task)
+        self.enqueue(task)
+
+    def schedule_many(self, jobs: Iterable[Job]) -> List[Job]:
+        """Планирует пайплайн целиком после проверки графа зависимостей.
+
+        Цикл или зависимость, которая не запланирована и не выполнена, отклоняют весь пайплайн
+        до постановки в очередь. Возвращает задачи в топологическом порядке.
+        """
+        self.restore_all()
+        known = self.done_tasks | {task.unique_name for _, task in self.live_tasks()}
+        ordered = plan_pipeline(list(jobs), known)
+        for job in ordered:
+            self.schedule(job)
+        return ordered
+
+    def enqueue(self, task: Job) -> None:
+        self.queue_task(task, datetime.now())
+        # будим цикл, если он ждет наступления более позднего дедлайна
+        self.wake()
+
+    def queue_task(self, task: Union[Job, JobStub], now: datetime) -> None:
+        self.artifacts.add_reader(task.dependencies)
+        if task.start_at > now:
+            heapq.heappush(self.delayed_tasks, (task.start_at, next(self._sequence), task))
+        else:
+            self.release_task(task)
+
+    def wake(self) -> None:
+        """Прерывает ожидание цикла, безопасно вызывать из других потоков и обработчиков сигналов"""
+        self._wakeup.set()
+
+    def release_due_tasks(self) -> None:
+        """Выпускает из кучи все задачи, время запуска которых наступило"""
+        now = datetime.now()
+        while self.delayed_tasks and self.delayed_tasks[0][0] <= now:
+            _, _, task = heapq.heappop(self.delayed_tasks)
+            self.release_task(task)
+
+    def release_task(self, task: Job) -> None:
+        """Ставит задачу в очередь готовых либо в ожидание незавершенных зависимостей"""
+        pending = set(task.dependencies) - self.done_tasks
+        if not pending:
+            self.ready_tasks.append(task)
+            return
+        logger.info(f"Not all {task} dependencies are met, waiting")
+        self.tracer.waiting(task)
+        self.waiting_tasks[task.unique_name] = task
+        self.pending_dependencies[task.unique_name] = len(pending)
+        for dependency_name in pending:
+            self.dependents[dependency_name].append(task)
+
+    def complete_task(self, task: Job) -> None:
+        """Отмечает задачу выполненной и освобождает задачи, для которых она была последней зависимостью"""
+        task.save_to_done(self.done_log)
+        self.journal.record(DONE, task)
+        self.done_tasks.add(task.unique_name)
+        dependents = self.dependents.pop(task.unique_name, [])
+        for dependent in dependents:
+            if dependent.unique_name not in self.waiting_tasks:
+                # задача уже неудачна из-за другой своей зависимости
+                continue
+            self.pending_dependencies[dependent.unique_name] -= 1
+            if not self.pending_dependencies[dependent.unique_name]:
+                del self.pending_dependencies[dependent.unique_name]
+                self.tracer.released(dependent)
+                self.ready_tasks.append(self.waiting_tasks.pop(dependent.unique_name))
+        self.artifacts.release(task.dependencies)
+
+    def fail_task(self, task: Job) -> None:
+        self.journal.record(FAIL, task)
+        self.artifacts.release(task.dependencies)
+        self.fail_dependents(task)
+
+    def fail_dependents(self, task: Job) -> None:
+        """Зависимости неудачной задачи не будут выполнены: все задачи, которые от нее зависят, неудачны"""
+        failed = 0
+        blocked = self.dependents.pop(task.unique_name, [])
+        while blocked:
+            dependent = self.waiting_tasks.pop(blocked.pop().unique_name, None)
+            if dependent is None:
+                continue
+            del self.pending_dependencies[dependent.unique_name]
+            self.tracer.released(dependent)
+            self.journal.record(FAIL, dependent)
+            self.artifacts.release(dependent.dependencies)
+            blocked.extend(self.dependents.pop(dependent.unique_name, []))
+            failed += 1
+        if failed:
+            logger.warning(f"Task {task.unique_name} failed, {failed} dependent tasks are failed too")
+
+    def admit_ready_tasks(self) -> None:
+        """Запускает готовые задачи на свободные места в пуле, остальные ждут в очереди"""
+        if self.control.draining:
+            return
+        free_slots = self.pool_size - len(self.running_tasks)
+        if self.ready_tasks and free_slots <= 0:
+            logger.debug(f"Pool is full, {len(self.ready_tasks)} ready tasks are waiting")
+            return
+        started = 0
+        while started < free_slots:
+            admitted = self.ready_tasks.pop()
+            if admitted is None:
+                # оставшиеся готовые задачи в очередях, достигших лимита
+                break
+            task, wait = admitted
+            task = self.load_task(task)
+            if task is None or self.complete_from_cache(task):
+                continue
+            self.journal.record(START, task)
+            self.metrics.observe_queue_wait(task)
+            self.metrics.observe_admission_wait(task.queue, wait)
+            self.tracer.admitted(task, wait)
+            self.start_task(task)
+            started += 1
+
+    def load_task(self, task: Union[Job, JobStub]) -> Optional[Job]:
+        """Задача целиком; восстановленная из журнала задача десериализуется только здесь"""
+        if not isinstance(task, JobStub):
+            return task
+        try:
+            return task.load()
+        except Exception:
+            logger.error(f"Can't restore task {task.unique_name} from journal", exc_info=True)
+            self.fail_task(task)
+            return None
+
+    def complete_from_cache(self, task: Job) -> bool:
+        """Завершает задачу без запуска, если результат задачи с тем же отпечатком есть в кэше"""
+        fingerprint = task.fingerprint()
+        if fingerprint is None:
+            return False
+        cached = self.result_cache.get(fingerprint)
+        # запись без созданных задачей файлов не годится и считается промахом
+        hit = cached is not None and all(os.path.exists(path) for path in cached[1])
+        self.result_cache.record_lookup(hit)
+        self.metrics.inc("cache_hits" if hit else "cache_misses", task)
+        if not hit:
+            return False
+        logger.info(f"Task {task.unique_name} result is taken from cache")
+        task.restore_result(cached[0])
+        self.complete_task(task)
+        return True
+
+    def cache_result(self, task: Job) -> None:
+        fingerprint = task.fingerprint()
+        # из кэша задача завершается без запуска и не публикует буферы, которые ждут зависимые задачи
+        if fingerprint is not None and not os.path.isdir(self.artifacts.job_path(task.unique_name)):
+            self.result_cache.put(fingerprint, (task.result_state(), list(task.cached_outputs())))
+
+    def start_task(self, task: Job) -> None:
+        task_iterator = self.create_task_iterator(task)
+        self.tasks_mapping[task_iterator] = task
+        self.running_tasks.append(task_iterator)
+        self.ready_tasks.task_started(task)
+
+    def remove_running_task(self, running_task: Iterator) -> None:
+        """Убирает из пула задачу, итератор которой стоит первым в очереди"""
+        self.running_tasks.popleft()
+        self.ready_tasks.task_stopped(self.tasks_mapping.pop(running_task))
+
+    def create_task_iterator(self, task: Job) -> Iterator:
+        if task.executor is None:
+            return iter(task)
+        return self.offloaded_task_steps(task)
+
+    def offloaded_task_steps(self, task: Job) -> Generator:
+        """Выполняет шаги задачи целиком в пуле потоков или процессов, цикл только ждет результат.
+
+        Шаги всегда идут над копией задачи: экземпляр планировщика не меняется, пока его
+        сохраняют контрольная точка и снапшот, и получает состояние копии после завершения.
+        """
+        if task.executor == "process":
+            future = self.process_pool.submit(run_job_steps, task)
+        else:
+            future = self.offload_pool.submit(Blocking(run_job_steps, copy.deepcopy(task)))
+        steps, state = yield future
+        # задача работала с копией, переносим ее состояние
+        task.update_state(state)
+        logger.info(f"Task {task.unique_name} made {steps} steps in {task.executor} pool")
+
+    def wait_next_deadline(self) -> None:
+        """Спит ровно до времени запуска ближайшей отложенной задачи или до вызова schedule"""
+        if self.restoring is not None:
+            # зависимости могут быть среди еще не восстановленных задач
+            return
+        if not self.delayed_tasks:
+            # ничего не выполняется и не запланировано, а оставшиеся задачи ждут зависимостей
+            raise DependencyError
+        timeout = (self.delayed_tasks[0][0] - datetime.now()).total_seconds()
+        if timeout > 0:
+            logger.info(f"No tasks to run, waiting {timeout:.3f}s for the next scheduled task")
+        self.wait_wakeup(timeout)
+
+    def get_wakeup_timeout(self) -> Optional[float]:
+        """Секунды до ближайшего дедлайна: запуска отложенной задачи или истечения времени выполняемой"""
+        deadlines = [
+            task.start_at + task.max_working_time
+            for task in self.tasks_mapping.values()
+            if task.max_working_time != -1
+        ]
+        if self.delayed_tasks:
+            deadlines.append(self.delayed_tasks[0][0])
+        if not deadlines:
+            return None
+        return max((min(deadlines) - datetime.now()).total_seconds(), 0)
+
+    def wait_wakeup(self, timeout: Optional[float]) -> None:
+        """Спит, пока не завершится блокирующая работа, не придет команда, не будет вызван schedule
+        или не истечет timeout"""
+        if timeout is None or timeout > 0:
+            started = time.perf_counter()
+            self._wakeup.wait(timeout)
+            self.metrics.add_idle(time.perf_counter() - started)
+        self._wakeup.clear()
+
+    @property
+    def offload_pool(self) -> OffloadPool:
+        if self._offload_pool is None:
+            self._offload_pool = OffloadPool()
+        return self._offload_pool
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE)
+        return self._process_pool
+
+    @property
+    def result_cache(self) -> ResultCache:
+        if self._result_cache is None:
+            self._result_cache = ResultCache()
+        return self._result_cache
+
+    @property
+    def http_client(self) -> HttpClient:
+        """Общий для всех задач HTTP-клиент с пулом keep-alive соединений"""
+        if self._http_client is None:
+            self._http_client = HttpClient()
+        return self._http_client
+
+    def shutdown_offload_pool(self) -> None:
+        if self._offload_pool is not None:
+            self._offload_pool.shutdown()
+            self._offload_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+        if self._result_cache is not None:
+            self._result_cache.close()
+
     @staticmethod
-    def init_dirs():
+    def is_offloadable(value) -> bool:
+        """Шаг отдал работу для пула: Blocking, HttpGet, Future, список или AnyOf из них"""
+        if isinstance(value, AnyOf):
+            value = value.items
+        if isinstance(value, list):
+            return bool(value) and all(isinstance(work, WORK_TYPES) for work in value)
+        return isinstance(value, WORK_TYPES)
+
+    def submit_work(self, work: Union[Blocking, HttpGet, Future]) -> Future:
+        if isinstance(work, Future):
+            return work
+        if isinstance(work, HttpGet):
+            return self.http_client.submit(work)
+        return self.offload_pool.submit(work)
+
+    def park_task(self, running_task: Iterator, work: Union[Blocking, HttpGet, Future, List, AnyOf]) -> None:
+        """Отдает блокирующую работу в пул, задача ждет результата, не останавливая остальные.
+
+        Список работ выполняется параллельно, в задачу возвращается список результатов.
+        По AnyOf задача продолжает после первой завершенной работы и получает список Future.
+        """
+        if isinstance(work, AnyOf):
+            work.futures = [self.submit_work(item) for item in work.items]
+            future = first_completed(work.futures)
+        elif isinstance(work, list):
+            future = gather_futures([self.submit_work(item) for item in work])
+        else:
+            future = self.submit_work(work)
+        future.add_done_callback(lambda _: self.wake())
+        self.parked_tasks[running_task] = future
+
+    def step_running_tasks(self) -> bool:
+        """Продвигает каждую выполняемую задачу на один шаг по кругу.
+
+        Возвращает True, если хотя бы одна задача продвинулась.
+        """
+        progressed = False
+        for _ in range(len(self.running_tasks)):
+            if self.control.stop_requested:
+                raise StopEventLoop
+            # итератор остается в очереди на время шага, чтобы его сохранил stop при прерывании
+            running_task = self.running_tasks[0]
+            keep, advanced = self.run_quantum(running_task)
+            progressed = progressed or advanced
+            if keep:
+                self.running_tasks.rotate(-1)
+            else:
+                self.remove_running_task(running_task)
+        return progressed
+
+    def run_quantum(self, running_task: Generator) -> Tuple[bool, bool]:
+        """Делает шаги задачи подряд, пока она не исчерпает квант, не отдаст работу в пул или не завершится.
+
+        Возвращает пару (задача остается в пуле, задача продвинулась).
+        """
+        job_class = type(self.tasks_mapping[running_task]).__name__
+        max_steps = self.quantum.steps_for(job_class)
+        started = time.perf_counter()
+        keep, advanced = self.step_task(running_task)
+        steps = 1
+        while keep and advanced and steps < max_steps and running_task not in self.parked_tasks:
+            if time.perf_counter() - started >= self.quantum.budget or self.control.stop_requested:
+                break
+            keep, advanced = self.step_task(running_task)
+            steps += 1
+        if advanced:
+            self.quantum.observe(job_class, steps, time.perf_counter() - started)
+        return keep, advanced
+
+    def step_task(self, running_task: Generator) -> Tuple[bool, bool]:
+        """Выполняет один шаг задачи.
+
+        Возвращает пару (задача остается в пуле, задача продвинулась).
+        """
+        task = self.tasks_mapping[running_task]
+        future = self.parked_tasks.get(running_task)
+        if future is not None and not future.done() and not task.is_expired:
+            return True, False
+        started = time.perf_counter()
         try:
-            os.makedirs(QUEUED_TASKS_DIR, exist_ok=True)
-            os.makedirs(RUNNING_TASKS_DIR, exist_ok=True)
-            logger.info("All needed dirs exists")
-        except PermissionError:
-            logger.error("No permissions to create directories", exc_info=True)
+            if future is not None:
+                del self.parked_tasks[running_task]
+            if self.tracer.enabled:
+                value = self.tracer.profiled(task, self.advance, running_task, future)
+            else:
+                # без трассировки шаг не платит за лишние вызовы
+                value = next(running_task) if future is None else self.resume_parked_task(running_task, future)
+
+            if task.is_expired:
+                raise TimeoutError
+            if self.is_offloadable(value):
+                self.park_task(running_task, value)
+            self.dirty_tasks.setdefault(task.unique_name, task)
+            return True, True
+        except Exception as error:
+            self.handle_task_exit(task, error)
+        finally:
+            seconds = time.perf_counter() - started
+            self.metrics.observe_step(task, seconds)
+            if self.tracer.enabled:
+                self.tracer.step(task, started, seconds)
+        return False, True
+
+    def advance(self, running_task: Generator, future: Optional[Future]):
+        """Следующий шаг задачи: next() или возобновление с результатом блокирующей работы"""
+        if future is None:
+            return next(running_task)
+        return self.resume_parked_task(running_task, future)
+
+    @staticmethod
+    def resume_parked_task(running_task: Generator, future: Future):
+        """Передает в генератор задачи результат или исключение блокирующей работы"""
+        if not future.done():
+            # время выполнения истекло, пока задача ждала пул потоков
+            raise TimeoutError
+        error = future.exception()
+        if error is not None:
+            return running_task.throw(error)
+        return running_task.send(future.result())
+
+    def handle_task_exit(self, task: Job, error: BaseException) -> None:
+        """Обрабатывает выход задачи из пула: завершение, ретрай, таймаут или непредвиденную ошибку"""
+        # итог задачи записывается в журнал отдельным событием
+        self.dirty_tasks.pop(task.unique_name, None)
+        if isinstance(error, (StopIteration, StopAsyncIteration)):
+            logger.debug("Задача выполнена")
+            self.metrics.inc("tasks_completed", task)
+            self.tracer.event("done", task)
+            self.cache_result(task)
+            self.complete_task(task)
+        elif isinstance(error, TaskError):
+            self.retry_task(task)
+        elif isinstance(error, TimeoutError):
+            logger.warning("Был достигнут максимум времени на выполнение задачи")
+            self.metrics.inc("task_timeouts", task)
+            self.tracer.event("timeout", task)
+            self.fail_task(task)
+        else:
+            logger.error("Непредвиденная ошибка, дальнейшее выполнение задачи невозможно", exc_info=error)
+            self.metrics.inc("task_failures", task)
+            self.tracer.event("fail", task)
+            self.fail_task(task)
+
+    def retry_task(self, task: Job) -> None:
+        if task.max_tries > task.tries:
+            task.tries += 1
+            logger.debug(f"max_tries - {task.max_tries}, tries - {task.tries}")
+            # сбрасываем сохраненные этапы и запускаем новый итератор для новой попытки
+            task.reset()
+            self.metrics.inc("task_retries", task)
+            self.tracer.event("retry", task)
+            self.journal.record(RETRY, task)
+            self.start_task(task)
+        else:
+            logger.warning("Был достигнут максимум повторов выполнения задачи")
+            self.metrics.inc("task_failures", task)
+            self.fail_task(task)
+
+    def check_control(self) -> None:
+        """Применяет команды остановки и дренажа перед очередным проходом цикла"""
+        if self.control.stop_requested:
+            raise StopEventLoop
+        if self.control.draining and not self.running_tasks:
+            logger.info("All running tasks finished, drain completed")
+            raise StopEventLoop
+
+    def open_control(self, loop=None) -> None:
+        self.control.install_signal_handlers(loop)
+        if CONTROL_SOCKET:
+            self.control.serve(CONTROL_SOCKET)
+        self.metrics.open()
 
-    def schedule(self, task):
-        self.tasks.append(task)
+    def close_control(self) -> None:
+        self.control.restore_signal_handlers()
+        self.control.shutdown_server()
+        self.control.reset()
+        self.metrics.close()
+        self.tracer.close()
 
-    def run(self): # noqa C901
+    def run(self):
+        self.open_control()
         try:
-            while any([self.tasks, self.running_tasks]):
-                for _ in range(min(POOL_SIZE, len(self.tasks))):
-                    task: Job = self.tasks.pop(0)
-                    if task.start_at and task.start_at > datetime.now():
-                        logger.info(f"The scheduled execution time of the {task} task has not yet arrived, waiting")
-                        self.tasks.append(task)
-                        continue
-
-                    if not check_tasks_is_completed(task.dependencies):
-                        logger.info(f"Not all {task} dependencies are met, waiting")
-                        self.tasks.append(task)
-                        continue
-
-                    task_iterator = iter(task)
-                    self.tasks_mapping[task_iterator] = task
-                    self.running_tasks.append(task_iterator)
-
-                for running_task in self.running_tasks:
-                    if not self.is_running():
-                        # проверяем запущен ли луп
-                        raise StopEventLoop
-                    try:
-                        next(running_task)
-
-                        if self.tasks_mapping[running_task].is_expired:
-                            raise TimeoutError
-
-                    except StopIteration:
-                        logger.debug("Задача выполнена")
-                        self.running_tasks.remove(running_task)
-                        self.tasks_mapping[running_task].save_to_done()
-                        del self.tasks_mapping[running_task]
-                    except TaskError:
-                        task_instance = self.tasks_mapping[running_task]
-                        if task_instance.max_tries > task_instance.tries:
-                            task_instance.tries += 1
-                            logger.debug(f"max_tries - {task_instance.max_tries}, tries - {task_instance.tries}")
-                            # сбрасываем сохраненные этапы
-                            task_instance.reset()
-                            # удаляем старый итератор
-                            self.running_tasks.remove(running_task)
-                            del self.tasks_mapping[running_task]
-                            # добавляем новый для новой попытки
-                            task_iterator = iter(task_instance.run())
-                            self.running_tasks.append(task_iterator)
-                            self.tasks_mapping[task_iterator] = task_instance
-                        else:
-                            logger.warning("Был достигнут максимум повторов выполнения задачи")
-                            self.running_tasks.remove(running_task)
-                            del self.tasks_mapping[running_task]
-                    except TimeoutError:
-                        logger.warning("Был достигнут максимум времени на выполнение задачи")
-                        self.running_tasks.remove(running_task)
-                        del self.tasks_mapping[running_task]
-                    except Exception:
-                        logger.error("Непредвиденная ошибка, дальнейшее выполнение задачи невозможно", exc_info=True)
-                        self.running_tasks.remove(running_task)
-                        del self.tasks_mapping[running_task]
-
-                time.sleep(1)  # для более наглядной проверки
+            while any([self.restoring, self.delayed_tasks, self.ready_tasks, self.waiting_tasks, self.running_tasks]):
+                self.check_control()
+                if self.control.paused:
+                    self.wait_wakeup(None)
+                    continue
+                tick_started = time.perf_counter()
+                self.restore_batch()
+                self.release_due_tasks()
+                self.admit_ready_tasks()
+                if not self.running_tasks:
+                    self.wait_next_deadline()
+                    continue
+                progressed = self.step_running_tasks()
+                self.commit_pass()
+                self.metrics.observe_tick(time.perf_counter() - tick_started)
+                if not progressed:
+                    # все задачи пула ждут блокирующую работу
+                    self.wait_wakeup(self.get_wakeup_timeout())
 
             logger.info("All tasks done. Start clean up")
             self.clean_up()
         except StopEventLoop:
-            logger.info("Get signal to stop from file")
+            logger.info("Get stop signal from control channel")
             self.stop()
         except KeyboardInterrupt:
             logger.info("Get stop signal from KeyboardInterrupt")
             self.stop()
+        except DependencyError:
+            logger.error("Dependencies of the remaining tasks can't be met, stop with saving")
+            self.stop()
+        finally:
+            self.close_control()
+            self.done_log.commit(force=True)
+            self.shutdown_offload_pool()
 
     def restart(self):
         self.stop()
         self.run()
 
-    @staticmethod
-    def clean_up() -> None:
-        clean_dirs = [QUEUED_TASKS_DIR, RUNNING_TASKS_DIR]
-        for clean_dir in clean_dirs:
-            delete_files_in_dir(clean_dir)
-
-        if os.path.isfile(CONDITION_CACHE):
-            os.remove(CONDITION_CACHE)
-
-        if os.path.isfile(SCHEDULER_DATA):
-            os.remove(SCHEDULER_DATA)
+    def clean_up(self) -> None:
+        self.journal.clear()
+        self.artifacts.clear()
 
     def create_done_list(self):
         logger.info("Created file for done tasks")
-        with open(DONE_TASKS, "w"):
-            pass
+        self.done_log.truncate()
 
+    def status(self) -> Dict:
+        """Число задач по состояниям и разделы со статистикой пулов"""
+        status = {
+            "delayed": len(self.delayed_tasks),
+            "ready": len(self.ready_tasks),
+            "waiting": len(self.waiting_tasks),
+            "running": len(self.running_tasks),
+            "parked": len(self.parked_tasks),
+            "done": len(self.done_tasks),
+            "queues": self.ready_tasks.queue_stats(),
+        }
+        # пул создается при первой блокирующей работе, статус его не создает
+        offload_pool = self._offload_pool
+        if offload_pool is not None:
+            status["offload"] = offload_pool.stats()
+        if self._result_cache is not None:
+            status["result_cache"] = self._result_cache.status()
+        return status
 
-    def stop(self, save_data=True) -> None:
-        for task in self.tasks:
-            task.stop(save_data=save_data, running=False)
-        logger.info("List of tasks saved")
+    @property
+    def queued_tasks(self) -> List[Job]:
+        delayed_tasks = [task for _, _, task in self.delayed_tasks]
+        return delayed_tasks + list(self.ready_tasks) + list(self.waiting_tasks.values())
+
+    @property
+    def live_tasks_count(self) -> int:
+        return len(self.delayed_tasks) + len(self.ready_tasks) + len(self.waiting_tasks) + len(self.running_tasks)
 
+    def live_tasks(self) -> Iterable[Tuple[str, Job]]:
+        """Живые задачи со статусами для снапшота журнала"""
+        for task in self.queued_tasks:
+            yield QUEUED, task
         for running_task in self.running_tasks:
-            self.tasks_mapping[running_task].stop(save_data=save_data, running=True)
-        logger.info("List of running tasks saved")
+            yield RUNNING, self.tasks_mapping[running_task]
 
-        with open(SCHEDULER_DATA, "w") as file:
-            scheduler_data = {
-                "save_data": True,
-                "len_queued_tasks": len(self.tasks),
-                "len_running_tasks": len(self.running_tasks),
-            }
-            json.dump(scheduler_data, file)
+    def commit_pass(self) -> None:
+        """Фиксирует результаты прохода цикла: группу выполненных задач, контрольную точку
+        и при необходимости снапшот"""
+        self.done_log.commit()
+        if CHECKPOINT_INTERVAL and time.monotonic() - self._last_checkpoint >= CHECKPOINT_INTERVAL:
+            self.checkpoint(CHECKPOINT_MAX_BYTES)
+        if self.journal.needs_compaction(self.live_tasks_count):
+            self.compact()
+        self.metrics.export()
 
-    @staticmethod
-    def is_resume_after_stop() -> bool:
-        if os.path.isfile(SCHEDULER_DATA):
-            print(f"Файл {SCHEDULER_DATA} существует.")
-            return True
-        print(f"Файл {SCHEDULER_DATA} не существует.")
-        return False
+    def checkpoint(self, max_bytes: Optional[int] = None) -> None:
+        """Сохраняет в журнал только задачи, изменившиеся после прошлой контрольной точки"""
+        for unique_name in self.journal.checkpoint(list(self.dirty_tasks.values()), max_bytes):
+            del self.dirty_tasks[unique_name]
+        self._last_checkpoint = time.monotonic()
 
-    @staticmethod
-    def is_running() -> bool:
-        if os.path.isfile(CONDITION_CACHE):
-            logger.debug(f"Файл {CONDITION_CACHE} существует.")
-            with open(CONDITION_CACHE) as file:
-                condition_cache = json.load(file)
-                return condition_cache["is_running"]
-
-        with open(CONDITION_CACHE, "w") as file:
-            condition = {"is_running": True}
-            json.dump(condition, file)
+    def compact(self) -> None:
+        # снапшот забывает выполненные задачи, поэтому они должны быть уже записаны
+        self.done_log.commit(force=True)
+        # в снапшот попадают все живые задачи, и еще не поставленные в очереди тоже
+        self.restore_all()
+        self.journal.compact(self.live_tasks())
+        self.dirty_tasks.clear()
+
+    def stop(self, save_data=True) -> None:
+        self.done_log.commit(force=True)
+        if not save_data:
+            logger.info("Exit without saving")
+            self.journal.close()
+            return
+        # неизменившиеся задачи уже есть в журнале, снапшот пишется, только если хвост вырос
+        saved = len(self.dirty_tasks)
+        self.checkpoint()
+        if self.journal.needs_compaction(self.live_tasks_count):
+            self.compact()
+        self.journal.close()
+        logger.info(f"Journal saved, {saved} changed tasks checkpointed")
+
+    def is_resume_after_stop(self) -> bool:
+        if self.journal.exists():
+            print(f"Журнал {self.journal.path} существует.")
             return True
+        print(f"Журнал {self.journal.path} не существует.")
+        return False
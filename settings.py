@@ -1,10 +1,62 @@
 import logging
 
-SCHEDULER_DATA = "scheduler_data.json"
 TASKS_DATA = "tasks_data.json"
 POOL_SIZE = 10
 LOGGING_LEVEL = logging.INFO
-CONDITION_CACHE = "_condition_cache.json"
-QUEUED_TASKS_DIR = "./queued_tasks/"
-RUNNING_TASKS_DIR = "./running_tasks/"
+# путь к Unix-сокету для команд stop/drain/pause/resume/status, None - сокет не открывается
+CONTROL_SOCKET = None
+JOURNAL_FILE = "_journal.log"
+JOURNAL_SNAPSHOT = "_journal_snapshot.pkl"
+# минимальная длина хвоста журнала, после которой он сворачивается в снапшот
+JOURNAL_COMPACT_EVERY = 10000
+# задач из журнала, которые ставятся в очереди за проход цикла после рестарта
+JOURNAL_RESTORE_BATCH = 1000
 DONE_TASKS = "_done_tasks.txt"
+OFFLOAD_POOL_SIZE = 4
+PROCESS_POOL_SIZE = None  # по числу ядер
+# политика fsync файла выполненных задач: none, batch (каждая группа) или interval (не чаще раза в интервал)
+DONE_TASKS_FSYNC = "interval"
+DONE_TASKS_FSYNC_INTERVAL_MS = 100
+# окно групповой записи выполненных задач, 0 - группа на каждый проход цикла
+DONE_TASKS_COMMIT_INTERVAL_MS = 0
+# метрики планировщика в формате Prometheus: HTTP-порт для /metrics и/или файл, None - не выгружать
+METRICS_ENABLED = False
+METRICS_HTTP_PORT = None
+METRICS_FILE = None
+METRICS_FILE_INTERVAL = 5  # секунды
+# общий HTTP-клиент задач: запросов в полете всего и к одному хосту, таймаут в секундах
+HTTP_MAX_IN_FLIGHT = 8
+HTTP_PER_HOST_LIMIT = 2
+HTTP_TIMEOUT = 10
+HTTP_MAX_REDIRECTS = 5
+# размер части тела ответа при потоковой загрузке в файл
+HTTP_CHUNK_SIZE = 64 * 1024
+# сколько загрузок одна задача ведет одновременно
+HTTP_JOB_FANOUT = 4
+# справедливое распределение мест в пуле между очередями задач (Job.queue)
+QUEUE_WEIGHTS = {}  # вес очереди, по умолчанию 1
+QUEUE_LIMITS = {}  # максимум одновременно выполняемых задач очереди, по умолчанию без лимита
+PRIORITY_AGING_SECONDS = 60  # за это время ожидания приоритет готовой задачи вырастает на 1, 0 - без старения
+# квант задачи за оборот пула: не больше STEP_QUANTUM_MAX_STEPS шагов подряд и STEP_QUANTUM_US микросекунд, 1 - по шагу
+STEP_QUANTUM_MAX_STEPS = 64
+STEP_QUANTUM_US = 2000
+# контрольные точки: состояние изменившихся задач дописывается в журнал раз в интервал, 0 - только при остановке
+CHECKPOINT_INTERVAL = 5  # секунды
+CHECKPOINT_MAX_BYTES = 1024 * 1024  # не больше на одну контрольную точку, остальные задачи пишутся в следующую
+# кэш результатов задач с заданными cache_inputs: срок жизни записи и размер, после которого вытесняются старые
+RESULT_CACHE_DIR = "_result_cache"
+RESULT_CACHE_TTL = 7 * 24 * 3600  # секунды
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# каталог буферов, которые задачи передают зависимым через mmap; в /dev/shm они не пишутся на диск
+ARTIFACTS_DIR = "_artifacts"
+# общее хранилище задач для нескольких процессов-исполнителей (worker.py): аренда задачи, ее продление и опрос
+TASK_STORE = "_tasks.sqlite3"
+STORE_LEASE_SECONDS = 30  # аренда, которую не продлили за это время, считается неудачной попыткой
+STORE_HEARTBEAT_SECONDS = 10
+STORE_POLL_INTERVAL = 0.1  # секунды между попытками взять работу, когда готовых задач нет
+# трассировка цикла в формате Chrome trace / Perfetto: файл трассы, None - не писать
+TRACE_FILE = None
+TRACE_MAX_EVENTS = 100000  # кольцевой буфер событий, старые вытесняются
+# имена классов задач, шаги которых профилируются cProfile; статистика пишется в PROFILE_DIR/<класс>.prof
+PROFILE_JOB_CLASSES = ()
+PROFILE_DIR = "_profiles"
@@ -0,0 +1,259 @@
+import pickle
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+from dag import plan_pipeline
+from job import Job, JobId
+from logger import logger
+from settings import STORE_LEASE_SECONDS, TASK_STORE
+
+# состояния задач в хранилище
+WAITING = "waiting"
+READY = "ready"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    start_at REAL NOT NULL,
+    priority INTEGER NOT NULL,
+    pending INTEGER NOT NULL,
+    tries INTEGER NOT NULL,
+    max_tries INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_by_state ON tasks (state, start_at);
+CREATE TABLE IF NOT EXISTS dependencies (
+    dependency_id INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    PRIMARY KEY (dependency_id, task_id)
+) WITHOUT ROWID;
+"""
+
+
+class TaskStore:
+    """Общее хранилище задач в SQLite (режим WAL), из которого берут работу несколько процессов.
+
+    Процесс-исполнитель берет готовые задачи в аренду на lease_seconds и продлевает ее
+    heartbeat-ом. Задачи исполнителя, который перестал продлевать аренду, считаются неудачной
+    попыткой и снова становятся готовыми. Зависимости и учет max_tries ведутся в хранилище.
+    Неудача задачи в той же транзакции делает неудачными все задачи, которые от нее зависят.
+    """
+
+    def __init__(self, path=TASK_STORE, lease_seconds=STORE_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        # транзакции открываются явно, чтобы захват задач шел под блокировкой записи
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+    def submit(self, jobs: Iterable[Job]) -> List[Job]:
+        """Добавляет пайплайн после проверки графа: зависимости должны быть в хранилище или в пайплайне"""
+        jobs = list(jobs)
+        with self.transaction() as cursor:
+            known = {row[0] for row in cursor.execute("SELECT id FROM tasks")}
+            done = {row[0] for row in cursor.execute("SELECT id FROM tasks WHERE state = ?", (DONE,))}
+            failed = {row[0] for row in cursor.execute("SELECT id FROM tasks WHERE state = ?", (FAILED,))}
+            ordered = plan_pipeline(jobs, known)
+            cursor.executemany(
+                "INSERT INTO tasks (id, state, payload, start_at, priority, pending, tries, max_tries)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self.task_row(job, done, failed) for job in ordered],
+            )
+            cursor.executemany(
+                "INSERT INTO dependencies (dependency_id, task_id) VALUES (?, ?)",
+                [(dependency, job.unique_name) for job in ordered for dependency in job.dependencies],
+            )
+        return ordered
+
+    @staticmethod
+    def task_row(job: Job, done: set, failed: set) -> tuple:
+        """Строка задачи; задача с неудачной зависимостью сразу неудачна, failed пополняется ею"""
+        pending = sum(1 for dependency in job.dependencies if dependency not in done)
+        if any(dependency in failed for dependency in job.dependencies):
+            failed.add(job.unique_name)
+            state = FAILED
+        else:
+            state = WAITING if pending else READY
+        return (
+            job.unique_name, state, pickle.dumps(job), job.start_at.timestamp(),
+            job.priority, pending, job.tries, job.max_tries,
+        )
+
+    def claim(self, worker: str, limit: int) -> List[Job]:
+        """Берет в аренду до limit готовых задач, время запуска которых наступило"""
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self.transaction() as cursor:
+            self.expire_leases(cursor, now)
+            rows = cursor.execute(
+                "SELECT id, payload, tries FROM tasks WHERE state = ? AND start_at <= ?"
+                " ORDER BY priority DESC, start_at, id LIMIT ?",
+                (READY, now, limit),
+            ).fetchall()
+            cursor.executemany(
+                "UPDATE tasks SET state = ?, lease_owner = ?, lease_expires = ? WHERE id = ?",
+                [(LEASED, worker, now + self.lease_seconds, task_id) for task_id, *_ in rows],
+            )
+        jobs = []
+        for _, payload, tries in rows:
+            job = pickle.loads(payload)
+            # попытки, потерянные с арендой упавшего исполнителя, есть только в хранилище
+            job.tries = tries
+            jobs.append(job)
+        return jobs
+
+    def expire_leases(self, cursor: sqlite3.Cursor, now: float) -> None:
+        """Аренда, которую не продлили, считается неудачной попыткой выполнения"""
+        expired = cursor.execute(
+            "SELECT id, lease_owner, tries, max_tries FROM tasks WHERE state = ? AND lease_expires < ?",
+            (LEASED, now),
+        ).fetchall()
+        for task_id, owner, tries, max_tries in expired:
+            logger.warning(f"Lease of task {task_id} by {owner} expired")
+            state = FAILED if tries + 1 > max_tries else READY
+            cursor.execute(
+                "UPDATE tasks SET tries = tries + 1, lease_owner = NULL, lease_expires = NULL, state = ? WHERE id = ?",
+                (state, task_id),
+            )
+            if state == FAILED:
+                self.fail_dependents(cursor, task_id)
+
+    def heartbeat(self, worker: str, task_ids: Iterable[JobId], checkpoints: Dict[JobId, Job]) -> List[JobId]:
+        """Продлевает аренду задач исполнителя и сохраняет состояние изменившихся.
+
+        Возвращает задачи, аренда которых потеряна: их нужно убрать из пула.
+        """
+        task_ids = list(task_ids)
+        expires = time.time() + self.lease_seconds
+        lost = []
+        with self.transaction() as cursor:
+            for task_id in task_ids:
+                job = checkpoints.get(task_id)
+                if job is None:
+                    cursor.execute(
+                        "UPDATE tasks SET lease_expires = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                        (expires, task_id, LEASED, worker),
+                    )
+                else:
+                    cursor.execute(
+                        "UPDATE tasks SET lease_expires = ?, payload = ?"
+                        " WHERE id = ? AND state = ? AND lease_owner = ?",
+                        (expires, pickle.dumps(job), task_id, LEASED, worker),
+                    )
+                if not cursor.rowcount:
+                    lost.append(task_id)
+        return lost
+
+    def complete(self, worker: str, job: Job) -> bool:
+        """Отмечает задачу выполненной и делает готовыми задачи, для которых она была последней зависимостью"""
+        with self.transaction() as cursor:
+            if not self.finish(cursor, worker, job, DONE):
+                return False
+            cursor.execute(
+                "UPDATE tasks SET pending = pending - 1"
+                " WHERE id IN (SELECT task_id FROM dependencies WHERE dependency_id = ?)",
+                (job.unique_name,),
+            )
+            cursor.execute(
+                "UPDATE tasks SET state = ? WHERE state = ? AND pending = 0"
+                " AND id IN (SELECT task_id FROM dependencies WHERE dependency_id = ?)",
+                (READY, WAITING, job.unique_name),
+            )
+        return True
+
+    def retry(self, worker: str, job: Job) -> bool:
+        """Возвращает задачу в очередь для новой попытки или отмечает ее неудачной, если попытки кончились"""
+        with self.transaction() as cursor:
+            (tries, max_tries), = cursor.execute(
+                "SELECT tries, max_tries FROM tasks WHERE id = ?", (job.unique_name,)
+            ).fetchall()
+            state = READY if tries < max_tries else FAILED
+            if state == READY:
+                job.tries = tries + 1
+            if not self.finish(cursor, worker, job, state, tries=job.tries if state == READY else None):
+                return False
+        return state == READY
+
+    def release(self, worker: str, jobs: Iterable[Job]) -> None:
+        """Возвращает задачи остановленного исполнителя в очередь с их текущим состоянием, попытка не тратится"""
+        with self.transaction() as cursor:
+            for job in jobs:
+                self.finish(cursor, worker, job, READY)
+
+    def fail(self, worker: str, job: Job) -> bool:
+        with self.transaction() as cursor:
+            return self.finish(cursor, worker, job, FAILED)
+
+    def finish(self, cursor: sqlite3.Cursor, worker: str, job: Job, state: str, tries: Optional[int] = None) -> bool:
+        """Снимает аренду и переводит задачу в state, если аренда все еще у этого исполнителя"""
+        cursor.execute(
+            "UPDATE tasks SET state = ?, payload = ?, tries = COALESCE(?, tries),"
+            " lease_owner = NULL, lease_expires = NULL WHERE id = ? AND state = ? AND lease_owner = ?",
+            (state, pickle.dumps(job), tries, job.unique_name, LEASED, worker),
+        )
+        if not cursor.rowcount:
+            logger.warning(f"Task {job.unique_name} lease was lost by {worker}, result is dropped")
+            return False
+        if state == FAILED:
+            self.fail_dependents(cursor, job.unique_name)
+        return True
+
+    @staticmethod
+    def fail_dependents(cursor: sqlite3.Cursor, task_id: JobId) -> None:
+        """Зависимости неудачной задачи не будут выполнены: все задачи, которые от нее зависят, неудачны"""
+        cursor.execute(
+            "WITH RECURSIVE blocked(id) AS ("
+            " SELECT task_id FROM dependencies WHERE dependency_id = ?"
+            " UNION SELECT dependencies.task_id FROM dependencies"
+            " JOIN blocked ON dependencies.dependency_id = blocked.id"
+            ") UPDATE tasks SET state = ? WHERE state = ? AND id IN (SELECT id FROM blocked)",
+            (task_id, FAILED, WAITING),
+        )
+        if cursor.rowcount:
+            logger.warning(f"Task {task_id} failed, {cursor.rowcount} dependent tasks are failed too")
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.connection.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def has_unfinished(self) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM tasks WHERE state IN (?, ?, ?) LIMIT 1", (WAITING, READY, LEASED)
+        ).fetchone()
+        return row is not None
+
+    def next_start_at(self) -> Optional[float]:
+        """Время запуска ближайшей готовой задачи, которая ждет своего start_at"""
+        row = self.connection.execute("SELECT MIN(start_at) FROM tasks WHERE state = ?", (READY,)).fetchone()
+        return row[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class Transaction:
+    """BEGIN IMMEDIATE сразу берет блокировку записи, поэтому два исполнителя не возьмут одну задачу"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Cursor:
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.cursor.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        self.cursor.close()
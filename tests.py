@@ -1,12 +1,43 @@
+import asyncio
+import glob
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import pstats
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import warnings
 from datetime import datetime, timedelta
-from unittest.mock import MagicMock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+from urllib.request import urlopen
 
-from exceptions import TaskError
+from artifacts import artifacts
+from async_scheduler import AsyncScheduler
+from bench import run_scenario
+from control import send_command
+from exceptions import ArtifactNotFoundError, DependencyCycleError, TaskError, UnknownDependencyError
+from fair_queue import FairQueue
+from http_client import HttpClient, HttpGet
 from job import Job
+from journal import JobStub
 from logger import logger
+from main import SaveWebPagesTask
+from metrics import Metrics
+from offload import Blocking
+from quantum import StepQuantum
+from result_cache import ResultCache
 from scheduler import Scheduler
+from settings import POOL_SIZE, RESULT_CACHE_DIR
+from task_store import DONE, FAILED, READY, WAITING, TaskStore
+from tracing import Tracer
 from utils import check_task_in_completed
+from worker import StoreWorker
 
 
 class TestJob(Job):
@@ -48,10 +79,223 @@ class TestJob(Job):
         self.second_stage = None
 
 
+class AsyncTestJob(Job):
+    def __init__(self, delay=0.0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.stage = None
+
+    async def run(self):
+        if not self.stage:
+            await asyncio.sleep(self.delay)
+            yield self
+            await asyncio.sleep(self.delay)
+            self.stage = "stage"
+            yield self
+
+    def reset(self):
+        self.stage = None
+
+
+class BlockingTestJob(Job):
+    def __init__(self, delay, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.result = None
+
+    def run(self):
+        yield self
+        self.result = yield Blocking(self.sleep_and_return, self.delay)
+        yield self
+
+    @staticmethod
+    def sleep_and_return(delay):
+        time.sleep(delay)
+        return delay
+
+    def reset(self):
+        self.result = None
+
+
+class ProcessTestJob(Job):
+    def __init__(self, numbers, fail_times=0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.numbers = numbers
+        self.fail_times = fail_times
+        self.result = None
+        self.pid = None
+
+    def run(self):
+        if self.tries < self.fail_times:
+            raise TaskError
+        self.pid = os.getpid()
+        yield self
+        self.result = sum(number * number for number in self.numbers)
+        yield self
+
+    def reset(self):
+        self.result = None
+
+
+class ManyStepsJob(Job):
+    def __init__(self, steps, step_seconds=0.0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps = steps
+        self.step_seconds = step_seconds
+        self.done_steps = 0
+
+    def run(self):
+        for _ in range(self.steps):
+            time.sleep(self.step_seconds)
+            self.done_steps += 1
+            yield self
+
+    def reset(self):
+        self.done_steps = 0
+
+
+class SlowStepsJob(ManyStepsJob):
+    pass
+
+
+class CachedJob(Job):
+    cache_inputs = ("value",)
+    runs = 0
+
+    def __init__(self, value, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value = value
+        self.result = None
+
+    def run(self):
+        CachedJob.runs += 1
+        yield self
+        self.result = self.value * 2
+
+    def reset(self):
+        self.result = None
+
+
+class ArtifactProducerJob(Job):
+    def run(self):
+        yield self
+        with artifacts.create(self, "data", 1024 * 1024) as buffer:
+            buffer[:] = bytes(range(256)) * 4096
+        yield self
+
+    def reset(self):
+        pass
+
+
+class ArtifactConsumerJob(Job):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checksum = None
+        self.zero_copy = None
+
+    def run(self):
+        yield self
+        view = artifacts.find(self, "data")
+        self.zero_copy = view.readonly and isinstance(view.obj, mmap.mmap)
+        self.checksum = sum(view[:1024])
+        view.release()
+        yield self
+
+    def reset(self):
+        self.checksum = None
+
+
+class FailingJob(Job):
+    def run(self):
+        yield self
+        raise TaskError
+
+    def reset(self):
+        pass
+
+
+def run_store_worker(path):
+    StoreWorker(path).run()
+
+
+class FetchTestJob(Job):
+    def __init__(self, urls, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.urls = urls
+        self.pages = {}
+
+    def run(self):
+        yield self
+        responses = yield [HttpGet(url) for url in self.urls]
+        for url, response in zip(self.urls, responses):
+            if not response.ok:
+                raise TaskError(f"GET {url}: HTTP {response.status_code}")
+            self.pages[url] = response.content
+            yield self
+
+    def reset(self):
+        self.pages = {}
+
+
+class SlowPageHandler(BaseHTTPRequestHandler):
+    """Локальная замена веб-сайта: отвечает с задержкой и считает одновременные запросы"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(0.2)
+        with server.lock:
+            server.in_flight -= 1
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RangeFileHandler(BaseHTTPRequestHandler):
+    """Отдает большой файл с поддержкой заголовка Range"""
+
+    protocol_version = "HTTP/1.1"
+    body = bytes(range(256)) * 1024
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get("Range"))
+        start = int(self.headers["Range"][len("bytes="):-1]) if self.headers.get("Range") else 0
+        if start >= len(self.body):
+            body = b"<html>Range Not Satisfiable</html>"
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(self.body)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(self.body) - 1}/{len(self.body)}")
+        self.send_header("Content-Length", str(len(self.body) - start))
+        self.end_headers()
+        self.wfile.write(self.body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
 class SchedulerTestCase(unittest.TestCase):
     def setUp(self):
         self.scheduler = Scheduler()
 
+    def tearDown(self):
+        self.scheduler.clean_up()
+        shutil.rmtree(RESULT_CACHE_DIR, ignore_errors=True)
+
     def test_schedule_and_run_single_task(self):
         job = TestJob()
         self.scheduler.schedule(job)
@@ -136,6 +380,847 @@ class SchedulerTestCase(unittest.TestCase):
         self.assertTrue(check_task_in_completed(job1.unique_name))
         self.assertTrue(check_task_in_completed(job2.unique_name))
 
+    def test_due_tasks_not_blocked_by_delayed_tasks(self):
+        delayed_jobs = [TestJob(start_at=datetime.now() + timedelta(hours=1)) for _ in range(100)]
+        due_job = TestJob()
+
+        # Отложенные задачи добавлены раньше готовой
+        for delayed_job in delayed_jobs:
+            self.scheduler.schedule(delayed_job)
+        self.scheduler.schedule(due_job)
+        self.scheduler.release_due_tasks()
+
+        # Готовая задача сразу попадает в очередь, отложенные остаются в куче
+        self.assertEqual(list(self.scheduler.ready_tasks), [due_job])
+        self.assertEqual(len(self.scheduler.delayed_tasks), len(delayed_jobs))
+        self.assertIs(self.scheduler.delayed_tasks[0][2], delayed_jobs[0])
+
+    def test_dependent_task_released_when_last_dependency_done(self):
+        first_dependency = TestJob()
+        second_dependency = TestJob()
+        dependent_job = TestJob(dependencies=[first_dependency, second_dependency])
+
+        self.scheduler.schedule(dependent_job)
+        self.assertIn(dependent_job.unique_name, self.scheduler.waiting_tasks)
+        self.assertEqual(self.scheduler.pending_dependencies[dependent_job.unique_name], 2)
+
+        # После первой зависимости задача все еще ждет
+        self.scheduler.complete_task(first_dependency)
+        self.assertNotIn(dependent_job, self.scheduler.ready_tasks)
+
+        # После последней зависимости задача сразу становится готовой
+        self.scheduler.complete_task(second_dependency)
+        self.assertEqual(list(self.scheduler.ready_tasks), [dependent_job])
+        self.assertFalse(self.scheduler.waiting_tasks)
+
+    def test_pool_size_is_enforced(self):
+        jobs = [TestJob() for _ in range(POOL_SIZE + 5)]
+        for job in jobs:
+            self.scheduler.schedule(job)
+
+        # Повторный прием не превышает размер пула
+        self.scheduler.admit_ready_tasks()
+        self.scheduler.admit_ready_tasks()
+        self.assertEqual(len(self.scheduler.running_tasks), POOL_SIZE)
+        self.assertEqual(len(self.scheduler.ready_tasks), 5)
+
+        # С квантом в один шаг каждая задача продвигается ровно на один шаг за проход
+        self.scheduler.quantum.max_steps = 1
+        self.scheduler.step_running_tasks()
+        self.assertEqual(len(self.scheduler.running_tasks), POOL_SIZE)
+        self.assertEqual(list(self.scheduler.tasks_mapping.values()), jobs[:POOL_SIZE])
+
+    def test_pool_size_argument(self):
+        scheduler = Scheduler(pool_size=2)
+        for _ in range(5):
+            scheduler.schedule(TestJob())
+        scheduler.admit_ready_tasks()
+        self.assertEqual(len(scheduler.running_tasks), 2)
+        self.assertEqual(len(scheduler.ready_tasks), 3)
+        scheduler.clean_up()
+
+    def test_failed_task_fails_its_dependents(self):
+        failing = FailingJob()
+        child = ManyStepsJob(1, dependencies=[failing])
+        slow = ManyStepsJob(5)
+        grandchild = ManyStepsJob(1, dependencies=[child, slow])
+        self.scheduler.schedule_many([failing, child, slow, grandchild])
+        self.scheduler.run()
+
+        # планировщик не ждет задач, зависимости которых уже не выполнятся, и не сохраняет их
+        self.assertFalse(self.scheduler.waiting_tasks)
+        self.assertTrue(check_task_in_completed(slow.unique_name))
+        self.assertFalse(check_task_in_completed(child.unique_name))
+        self.assertFalse(check_task_in_completed(grandchild.unique_name))
+        self.assertEqual(Scheduler().live_tasks_count, 0)
+
+    def test_fair_queue_weights_priority_and_limits(self):
+        queue = FairQueue(weights={"interactive": 3}, limits={"bulk": 1}, aging=0)
+        bulk_jobs = [TestJob() for _ in range(10)]
+        interactive_jobs = [TestJob() for _ in range(10)]
+        for job in bulk_jobs:
+            job.queue = "bulk"
+            queue.append(job)
+        for priority, job in enumerate(interactive_jobs):
+            job.queue = "interactive"
+            job.priority = priority
+            queue.append(job)
+
+        # Вес 3 против 1: на одну задачу bulk три interactive, внутри очереди - по приоритету
+        admitted = [queue.pop()[0] for _ in range(4)]
+        self.assertEqual([job.queue for job in admitted].count("bulk"), 1)
+        self.assertEqual([job for job in admitted if job.queue == "interactive"], interactive_jobs[:-4:-1])
+
+        # Очередь bulk достигла лимита выполняемых задач и пропускается
+        queue.task_started(next(job for job in admitted if job.queue == "bulk"))
+        popped = [queue.pop()[0] for _ in range(7)]
+        self.assertTrue(all(job.queue == "interactive" for job in popped))
+        self.assertIsNone(queue.pop())
+        self.assertEqual(len(queue), 9)
+        stats = queue.queue_stats()
+        self.assertEqual(stats["interactive"]["admitted"], 10)
+        self.assertEqual(stats["bulk"]["running"], 1)
+
+    def test_queue_stats_in_status_and_metrics(self):
+        self.scheduler.metrics = Metrics(status=self.scheduler.status, http_port=None, file_path=None)
+        for _ in range(3):
+            job = TestJob()
+            job.queue = "bulk"
+            self.scheduler.schedule(job)
+        self.scheduler.schedule(TestJob())
+
+        self.scheduler.run()
+
+        queues = self.scheduler.status()["queues"]
+        self.assertEqual(queues["bulk"]["admitted"], 3)
+        self.assertEqual(queues["default"]["admitted"], 1)
+        exposition = self.scheduler.metrics.render()
+        self.assertIn('scheduler_queue_admitted_total{queue="bulk"} 3', exposition)
+        self.assertIn('scheduler_queue_wait_max_seconds{queue="default"}', exposition)
+
+    def test_priority_aging_prevents_starvation(self):
+        queue = FairQueue(aging=0.05)
+        old_job, urgent_job = TestJob(), TestJob()
+        urgent_job.priority = 1
+        queue.append(old_job)
+        time.sleep(0.15)
+        # старая задача за время ожидания обогнала новую с более высоким приоритетом
+        queue.append(urgent_job)
+        self.assertIs(queue.pop()[0], old_job)
+
+    def test_schedule_many_rejects_invalid_graph(self):
+        first, second = TestJob(), TestJob()
+        first.dependencies = (second.unique_name,)
+        second.dependencies = (first.unique_name,)
+        with self.assertRaisesRegex(DependencyCycleError, str(first.unique_name)):
+            self.scheduler.schedule_many([first, second])
+
+        orphan = TestJob(dependencies=[TestJob()])
+        with self.assertRaises(UnknownDependencyError):
+            self.scheduler.schedule_many([TestJob(), orphan])
+        # Пайплайн с ошибкой не планируется даже частично
+        self.assertEqual(self.scheduler.live_tasks_count, 0)
+
+    def test_schedule_many_admits_critical_path_first(self):
+        independent = [TestJob() for _ in range(3)]
+        chain = [TestJob()]
+        for _ in range(3):
+            chain.append(TestJob(dependencies=[chain[-1]]))
+        # Зависимость может быть уже запланированной задачей
+        tail = TestJob(dependencies=[chain[-1]])
+
+        ordered = self.scheduler.schedule_many(independent + chain[::-1])
+        self.scheduler.schedule_many([tail])
+
+        self.assertLess(ordered.index(chain[0]), ordered.index(chain[1]))
+        self.assertEqual(chain[0].critical_path, 4)
+        self.assertIs(self.scheduler.ready_tasks.pop()[0], chain[0])
+
+    def test_job_pickles_only_own_state(self):
+        chain = [TestJob()]
+        for _ in range(2000):
+            chain.append(TestJob(dependencies=[chain[-1]]))
+
+        # Зависимости хранятся идентификаторами, размер записи не зависит от длины цепочки
+        self.assertEqual(chain[-1].dependencies, (chain[-2].unique_name,))
+        self.assertLess(len(pickle.dumps(chain[-1])), 2 * len(pickle.dumps(chain[0])))
+        restored = pickle.loads(pickle.dumps(chain[-1]))
+        self.assertEqual(restored.unique_name, chain[-1].unique_name)
+        self.assertEqual(restored.dependencies, chain[-1].dependencies)
+        self.assertFalse(hasattr(Job(), "__dict__"))
+
+    def test_job_state_with_other_slot_layout_is_rejected(self):
+        class SavedJob(Job):
+            __slots__ = ("first", "second")
+
+        # тот же класс в новой версии кода: слоты переставлены
+        class ReorderedJob(Job):
+            __slots__ = ("second", "first")
+
+        job = SavedJob()
+        job.first, job.second = 1, 2
+        state = job.__getstate__()
+        restored = SavedJob.__new__(SavedJob)
+        restored.__setstate__(state)
+        self.assertEqual((restored.first, restored.second), (1, 2))
+        with self.assertRaises(pickle.UnpicklingError):
+            ReorderedJob.__new__(ReorderedJob).__setstate__(state)
+
+    def test_step_quantum_adapts_to_step_duration(self):
+        self.scheduler.quantum = StepQuantum(max_steps=50, budget_us=20000)
+        fast_job = ManyStepsJob(steps=1000)
+        slow_job = SlowStepsJob(steps=10, step_seconds=0.015)
+        for job in (fast_job, slow_job):
+            self.scheduler.start_task(job)
+
+        self.scheduler.step_running_tasks()
+        self.scheduler.step_running_tasks()
+
+        # Короткие шаги идут пачкой до лимита кванта, длинные - по одному за оборот
+        self.assertEqual(fast_job.done_steps, 100)
+        self.assertLessEqual(slow_job.done_steps, 3)
+        self.assertEqual(self.scheduler.quantum.steps_for("SlowStepsJob"), 1)
+        self.assertEqual(self.scheduler.quantum.steps_for("ManyStepsJob"), 50)
+
+    def test_trace_and_profile_of_job_steps(self):
+        tmp_dir = tempfile.mkdtemp()
+        trace_path = os.path.join(tmp_dir, "trace.json")
+        profile_dir = os.path.join(tmp_dir, "profiles")
+        self.scheduler.tracer = Tracer(trace_path, max_events=1000, profile_classes=["ManyStepsJob"],
+                                       profile_dir=profile_dir)
+        root = ManyStepsJob(3, 0.001)
+        dependent = TestJob(max_tries=1, dependencies=[root])
+        dependent.test_method = MagicMock(side_effect=TaskError)
+        self.scheduler.schedule_many([root, dependent])
+        self.scheduler.run()
+
+        with open(trace_path) as file:
+            events = json.load(file)["traceEvents"]
+        categories = {(event.get("cat"), event["name"]) for event in events if event["ph"] != "M"}
+        self.assertTrue({
+            ("step", "ManyStepsJob"), ("step", "TestJob"), ("admission", "admission"),
+            ("dependency_wait", "dependency_wait"), ("job", "retry"), ("job", "done"),
+        } <= categories)
+        root_steps = [event for event in events if event.get("cat") == "step" and event["name"] == "ManyStepsJob"]
+        self.assertEqual(len(root_steps), 4)
+        self.assertEqual(root_steps[0]["args"], {"job": str(root.unique_name), "class": "ManyStepsJob"})
+        self.assertGreaterEqual(root_steps[0]["dur"], 1000)
+        # профилируются только шаги выбранного класса
+        functions = {function for _, _, function in pstats.Stats(os.path.join(profile_dir, "ManyStepsJob.prof")).stats}
+        self.assertIn("run", functions)
+        self.assertEqual(os.listdir(profile_dir), ["ManyStepsJob.prof"])
+
+        # буфер ограничен: старые события вытесняются
+        tracer = Tracer(None, max_events=3)
+        for _ in range(5):
+            tracer.event("retry", root)
+        self.assertEqual((len(tracer.events), tracer.dropped), (3, 2))
+        shutil.rmtree(tmp_dir)
+
+    def test_blocking_steps_run_in_thread_pool(self):
+        jobs = [BlockingTestJob(delay=0.3) for _ in range(4)]
+        for job in jobs:
+            self.scheduler.schedule(job)
+
+        started = time.monotonic()
+        self.scheduler.run()
+
+        # Блокирующие шаги выполняются параллельно, результат возвращается в генератор
+        self.assertLess(time.monotonic() - started, 0.3 * len(jobs))
+        for job in jobs:
+            self.assertEqual(job.result, 0.3)
+            self.assertTrue(check_task_in_completed(job.unique_name))
+
+    def test_process_executor_reports_state_and_retries(self):
+        job = ProcessTestJob(numbers=list(range(1000)), fail_times=1, max_tries=2, executor="process")
+        dependent_job = TestJob(dependencies=[job])
+        self.scheduler.schedule(job)
+        self.scheduler.schedule(dependent_job)
+        self.scheduler.run()
+
+        # Состояние задачи вернулось из процесса пула, ошибка в процессе привела к ретраю
+        self.assertEqual(job.result, sum(number * number for number in range(1000)))
+        self.assertNotEqual(job.pid, os.getpid())
+        self.assertEqual(job.tries, 1)
+        self.assertTrue(check_task_in_completed(job.unique_name))
+        self.assertTrue(check_task_in_completed(dependent_job.unique_name))
+
+    def test_thread_executor_steps_run_on_copy(self):
+        job = ProcessTestJob(numbers=list(range(1000)), executor="thread")
+        steps = self.scheduler.create_task_iterator(job)
+        future = next(steps)
+        future.result()
+
+        # пока шаги идут в потоке, контрольная точка сохраняет неизменный экземпляр планировщика
+        self.assertIsNone(job.result)
+        self.scheduler.dirty_tasks[job.unique_name] = job
+        self.scheduler.checkpoint()
+        with self.assertRaises(StopIteration):
+            steps.send(future.result())
+        self.assertEqual(job.result, sum(number * number for number in range(1000)))
+        self.assertEqual(job.pid, os.getpid())
+
+    def test_restore_from_journal_snapshot_and_tail(self):
+        delayed_job = TestJob(start_at=datetime.now() + timedelta(hours=1))
+        dependency_job = TestJob()
+        dependent_job = TestJob(dependencies=[dependency_job])
+        for job in (delayed_job, dependency_job, dependent_job):
+            self.scheduler.schedule(job)
+
+        # Снапшот, затем хвост журнала: зависимость выполнена после снапшота
+        self.scheduler.compact()
+        self.scheduler.admit_ready_tasks()
+        self.scheduler.complete_task(dependency_job)
+        self.scheduler.journal.close()
+        self.scheduler.done_log.close()
+
+        restored = Scheduler()
+        restored_names = {task.unique_name for task in restored.queued_tasks}
+        restored_names.update(task.unique_name for task in restored.tasks_mapping.values())
+        self.assertEqual(restored_names, {delayed_job.unique_name, dependent_job.unique_name})
+        self.assertIn(dependency_job.unique_name, restored.done_tasks)
+        self.assertEqual(restored.delayed_tasks[0][2].unique_name, delayed_job.unique_name)
+
+    def test_compact_syncs_snapshot_before_truncating_tail(self):
+        self.scheduler.schedule(TestJob())
+        calls = []
+        real_fsync, real_replace = os.fsync, os.replace
+
+        def fsync(fd):
+            calls.append(("fsync", os.path.isdir(f"/proc/self/fd/{fd}")))
+            real_fsync(fd)
+
+        def replace(source, target):
+            calls.append(("replace", os.path.getsize(self.scheduler.journal.path) > 0))
+            real_replace(source, target)
+
+        self.scheduler.journal.flush()
+        with patch("os.fsync", fsync), patch("os.replace", replace):
+            self.scheduler.compact()
+        # снапшот на диске до замены, каталог - после, и все это пока хвост не обрезан
+        self.assertEqual(calls, [("fsync", False), ("replace", True), ("fsync", True)])
+        self.assertEqual(os.path.getsize(self.scheduler.journal.path), 0)
+
+    def test_restore_reads_index_and_unpickles_jobs_on_admission(self):
+        root = TestJob()
+        dependents = [TestJob(dependencies=[root]) for _ in range(3)]
+        self.scheduler.schedule_many([root, *dependents])
+        self.scheduler.admit_ready_tasks()
+        self.scheduler.stop()
+
+        restored = Scheduler()
+        # выполнявшаяся задача восстановлена целиком и зарегистрирована в пуле, остальные - только индекс
+        self.assertEqual([task.unique_name for task in restored.tasks_mapping.values()], [root.unique_name])
+        self.assertIsInstance(next(iter(restored.tasks_mapping.values())), TestJob)
+        self.assertTrue(all(isinstance(task, JobStub) for task in restored.queued_tasks))
+        self.assertEqual(restored.queued_tasks[0].dependencies, (root.unique_name,))
+
+        # свертка хвоста переносит задачи в снапшот без десериализации
+        restored.compact()
+        self.assertTrue(all(isinstance(task, JobStub) for task in restored.queued_tasks))
+        restored.run()
+        self.assertTrue(all(check_task_in_completed(job.unique_name) for job in [root, *dependents]))
+
+    def test_checkpoint_saves_only_changed_tasks_and_survives_crash(self):
+        jobs = [TestJob() for _ in range(3)]
+        for job in jobs:
+            self.scheduler.schedule(job)
+        self.scheduler.admit_ready_tasks()
+        # первая задача проходит первый этап, остальные делают по шагу
+        self.scheduler.quantum.max_steps = 4
+        self.scheduler.step_running_tasks()
+        self.assertEqual(jobs[0].first_stage, "first_stage")
+
+        # Бюджет в один байт: в контрольную точку попадает одна задача, остальные ждут следующей
+        self.scheduler.checkpoint(max_bytes=1)
+        self.assertEqual(list(self.scheduler.dirty_tasks), [job.unique_name for job in jobs[1:]])
+        self.scheduler.checkpoint()
+        self.assertFalse(self.scheduler.dirty_tasks)
+
+        # Аварийное завершение без stop: состояние восстанавливается из контрольной точки
+        self.scheduler.journal.close()
+        restored = Scheduler()
+        restored_jobs = {task.unique_name: task for task in restored.tasks_mapping.values()}
+        self.assertEqual(set(restored_jobs), {job.unique_name for job in jobs})
+        self.assertEqual(restored_jobs[jobs[0].unique_name].first_stage, "first_stage")
+        restored.run()
+        self.assertTrue(all(check_task_in_completed(job.unique_name) for job in jobs))
+
+    def test_identical_job_is_taken_from_result_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.scheduler._result_cache = ResultCache(path=cache_dir)
+        self.scheduler.schedule_many([CachedJob(3), CachedJob(4)])
+        self.scheduler.run()
+        runs = CachedJob.runs
+
+        # Повторный запуск того же пайплайна: задача не выполняется, но освобождает зависимую
+        scheduler = Scheduler()
+        scheduler._result_cache = ResultCache(path=cache_dir)
+        cached_job = CachedJob(3)
+        dependent_job = TestJob(dependencies=[cached_job])
+        scheduler.schedule_many([cached_job, dependent_job])
+        scheduler.run()
+
+        self.assertEqual(CachedJob.runs, runs)
+        self.assertEqual(cached_job.result, 6)
+        self.assertTrue(check_task_in_completed(cached_job.unique_name))
+        self.assertTrue(check_task_in_completed(dependent_job.unique_name))
+        self.assertEqual(scheduler.result_cache.stats["hits"], 1)
+        self.assertEqual(scheduler.result_cache.hit_rate, 1.0)
+
+    def test_cache_entry_without_outputs_is_one_miss(self):
+        cache = ResultCache(path=tempfile.mkdtemp())
+        self.scheduler._result_cache = cache
+        self.scheduler.metrics = Metrics(status=self.scheduler.status, http_port=None, file_path=None)
+        job = CachedJob(5)
+        # запись есть, но файла, который создала задача, уже нет
+        cache.put(job.fingerprint(), (job.result_state(), [os.path.join(cache.path, "missing.txt")]))
+        self.scheduler.schedule(job)
+
+        self.scheduler.run()
+
+        self.assertEqual(job.result, 10)
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (0, 1))
+        self.assertEqual(self.scheduler.status()["result_cache"]["hit_rate"], 0.0)
+        exposition = self.scheduler.metrics.render()
+        self.assertIn('scheduler_cache_misses_total{job_class="CachedJob"} 1', exposition)
+        self.assertNotIn("scheduler_cache_hits_total", exposition)
+        self.assertIn("scheduler_result_cache_misses_total 1", exposition)
+        self.assertIn("scheduler_result_cache_hit_ratio 0.0", exposition)
+
+    def test_result_cache_ttl_and_lru_eviction(self):
+        cache = ResultCache(path=tempfile.mkdtemp(), max_bytes=100)
+        cache.put("aa1", b"x" * 30)
+        cache.put("bb2", b"x" * 30)
+        cache.get("aa1")
+        # Превышение размера вытесняет давно не использованную запись
+        cache.put("cc3", b"x" * 30)
+        self.assertIsNone(cache.get("bb2"))
+        self.assertEqual(cache.get("aa1"), b"x" * 30)
+        self.assertEqual(cache.stats["evicted"], 1)
+
+        cache.ttl = -1
+        self.assertIsNone(cache.get("cc3"))
+        self.assertEqual(cache.stats["expired"], 1)
+        self.assertEqual(ResultCache(path=cache.path).entries.keys(), {"aa1"})
+
+    def test_artifacts_passed_to_dependents_without_copy(self):
+        producer = ArtifactProducerJob(executor="process")
+        consumers = [ArtifactConsumerJob(dependencies=[producer]) for _ in range(2)]
+        self.scheduler.schedule_many([producer, *consumers])
+
+        self.scheduler.run()
+
+        # Буфер, записанный в пуле процессов, читается зависимыми задачами через mmap
+        for consumer in consumers:
+            self.assertTrue(consumer.zero_copy)
+            self.assertEqual(consumer.checksum, sum(range(256)) * 4)
+        # После последней зависимой задачи буферы производителя удалены
+        self.assertFalse(os.path.exists(artifacts.job_path(producer.unique_name)))
+        self.assertFalse(artifacts.readers)
+
+    def test_artifacts_wait_for_delayed_dependents(self):
+        producer = ArtifactProducerJob()
+        consumer = ArtifactConsumerJob(dependencies=[producer])
+        # зависимая задача ждет своего времени запуска, когда производитель уже завершен
+        delayed_consumer = ArtifactConsumerJob(
+            dependencies=[producer], start_at=datetime.now() + timedelta(seconds=0.5)
+        )
+        self.scheduler.schedule_many([producer, consumer, delayed_consumer])
+
+        self.scheduler.run()
+
+        self.assertEqual(consumer.checksum, sum(range(256)) * 4)
+        self.assertEqual(delayed_consumer.checksum, sum(range(256)) * 4)
+        self.assertFalse(os.path.exists(artifacts.job_path(producer.unique_name)))
+        # буфер, которого нет у зависимостей, - явная ошибка, а не None
+        with self.assertRaises(ArtifactNotFoundError):
+            artifacts.find(ArtifactConsumerJob(dependencies=[producer]), "data")
+
+    def test_done_log_commits_group_once_per_pass(self):
+        jobs = [TestJob() for _ in range(3)]
+        for job in jobs:
+            self.scheduler.complete_task(job)
+
+        # Зависимые задачи узнают о завершении сразу, файл пишется группой при фиксации прохода
+        self.assertTrue(all(job.unique_name in self.scheduler.done_tasks for job in jobs))
+        self.assertFalse(check_task_in_completed(jobs[0].unique_name))
+        self.scheduler.commit_pass()
+        self.assertEqual(self.scheduler.done_log.buffer, [])
+        self.assertTrue(all(check_task_in_completed(job.unique_name) for job in jobs))
+
+    def test_drain_finishes_running_tasks_and_keeps_queued(self):
+        running_job = TestJob()
+        queued_job = TestJob()
+        self.scheduler.schedule(running_job)
+        self.scheduler.admit_ready_tasks()
+        self.scheduler.schedule(queued_job)
+
+        self.scheduler.control.drain()
+        self.scheduler.run()
+
+        # Выполняемая задача завершена, новая не запускалась и сохранена в журнале
+        self.assertIn(running_job.unique_name, self.scheduler.done_tasks)
+        self.assertEqual(self.scheduler.queued_tasks, [queued_job])
+        self.assertTrue(self.scheduler.journal.exists())
+        self.assertFalse(self.scheduler.control.draining)
+
+    def test_control_socket_commands(self):
+        path = os.path.join(tempfile.mkdtemp(), "scheduler.sock")
+        self.scheduler.schedule(TestJob())
+        self.scheduler.control.serve(path)
+        try:
+            self.assertTrue(send_command(path, "pause")["paused"])
+            status = send_command(path, "status")
+            self.assertEqual(status["ready"], 1)
+            self.assertIn("error", send_command(path, "unknown"))
+            self.assertTrue(send_command(path, "stop")["stop_requested"])
+        finally:
+            self.scheduler.control.shutdown_server()
+        self.assertFalse(os.path.exists(path))
+
+    def test_metrics_exported_over_http_and_file(self):
+        metrics_file = os.path.join(tempfile.mkdtemp(), "metrics.prom")
+        self.scheduler.metrics = Metrics(status=self.scheduler.status, http_port=0, file_path=metrics_file)
+        job = TestJob(max_tries=1)
+        job.test_method = MagicMock(side_effect=TaskError)
+        self.scheduler.schedule(job)
+
+        self.scheduler.run()
+
+        # После завершения цикла метрики записаны в файл и по-прежнему доступны по HTTP
+        self.scheduler.metrics.open()
+        try:
+            port = self.scheduler.metrics._server.server_port
+            with urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                exposition = response.read().decode()
+        finally:
+            self.scheduler.metrics.close()
+
+        self.assertIn('scheduler_task_retries_total{job_class="TestJob"} 1', exposition)
+        self.assertIn('scheduler_task_failures_total{job_class="TestJob"} 1', exposition)
+        self.assertIn('scheduler_step_duration_seconds_count{job_class="TestJob"}', exposition)
+        self.assertIn('scheduler_tasks{state="running"} 0', exposition)
+        with open(metrics_file) as file:
+            self.assertIn("scheduler_tick_duration_seconds_count", file.read())
+
+    def test_offload_pool_load_in_status_and_metrics(self):
+        release = threading.Event()
+        pool = self.scheduler.offload_pool
+        futures = [pool.submit(Blocking(release.wait)) for _ in range(pool.max_workers + 2)]
+        try:
+            deadline = time.monotonic() + 5
+            while pool.active < pool.max_workers and time.monotonic() < deadline:
+                time.sleep(0.01)
+            status = self.scheduler.status()
+            exposition = Metrics(status=self.scheduler.status, http_port=None, file_path=None).render()
+        finally:
+            release.set()
+        for future in futures:
+            future.result()
+
+        # Все потоки заняты, две работы ждут в очереди
+        self.assertEqual(status["offload"]["active"], pool.max_workers)
+        self.assertEqual(status["offload"]["queued"], 2)
+        self.assertEqual(status["offload"]["saturated"], 1)
+        self.assertIn("scheduler_offload_queue_depth 2", exposition)
+        self.assertIn("scheduler_offload_saturated 1", exposition)
+
+    def test_http_fetch_is_concurrent_with_per_host_limit(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), SlowPageHandler)
+        server.lock = threading.Lock()
+        server.in_flight = server.max_in_flight = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        client = self.scheduler._http_client = HttpClient(max_in_flight=8, per_host_limit=2)
+        jobs = [FetchTestJob([f"{base}/{job}/{page}" for page in range(4)]) for job in range(2)]
+        for job in jobs:
+            self.scheduler.schedule(job)
+
+        started = time.monotonic()
+        try:
+            self.scheduler.run()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # 8 страниц по 0.2с при лимите 2 на хост: около 0.8с вместо 1.6с последовательно
+        self.assertLess(time.monotonic() - started, 1.4)
+        self.assertEqual(server.max_in_flight, 2)
+        self.assertEqual(jobs[1].pages[f"{base}/1/3"], b"/1/3")
+        self.assertEqual(client.stats["requests"], 8)
+        self.assertLessEqual(client.stats["connections_opened"], 2)
+        self.assertGreater(client.stats["connections_reused"], 0)
+
+    def test_streaming_download_resumes_with_range(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeFileHandler)
+        server.ranges = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/file.bin"
+        # загрузка прервана после первых 100000 байт, в файле есть еще часть, не попавшая в состояние задачи
+        filename = os.path.join(tempfile.mkdtemp(), "file.bin")
+        with open(filename, "wb") as file:
+            file.write(RangeFileHandler.body[:100500])
+        job = SaveWebPagesTask([url])
+        job.filenames[url] = filename
+        job.offsets[url] = 100000
+        self.scheduler.schedule(job)
+
+        try:
+            self.scheduler.run()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(server.ranges, ["bytes=100000-"])
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), RangeFileHandler.body)
+        self.assertEqual(job.offsets[url], len(RangeFileHandler.body))
+        self.assertTrue(check_task_in_completed(job.unique_name))
+
+    def test_web_pages_download_in_thread_executor(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeFileHandler)
+        server.ranges = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = [f"http://127.0.0.1:{server.server_port}/{page}.bin" for page in range(2)]
+        # HttpGet, AnyOf и Blocking задачи выполняются в рабочем потоке, а не в цикле планировщика
+        job = SaveWebPagesTask(urls, output_dir=tempfile.mkdtemp(), executor="thread")
+        self.scheduler.schedule(job)
+
+        try:
+            self.scheduler.run()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(job.urls, [])
+        for url in urls:
+            with open(job.filenames[url], "rb") as file:
+                self.assertEqual(file.read(), RangeFileHandler.body)
+        self.assertTrue(check_task_in_completed(job.unique_name))
+
+    def test_web_page_retry_overwrites_partial_file(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeFileHandler)
+        server.ranges = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/file.bin"
+        output_dir = tempfile.mkdtemp()
+        job = SaveWebPagesTask([url], output_dir=output_dir)
+        # первая попытка оборвалась на части файла
+        job.filenames[url] = os.path.join(output_dir, "file.bin")
+        job.offsets[url] = 1000
+        with open(job.filenames[url], "wb") as file:
+            file.write(b"x" * 1000)
+        job.reset()
+        self.scheduler.schedule(job)
+
+        try:
+            self.scheduler.run()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(server.ranges, [None])
+        self.assertEqual(os.listdir(output_dir), ["file.bin"])
+        with open(job.filenames[url], "rb") as file:
+            self.assertEqual(file.read(), RangeFileHandler.body)
+
+    def test_finished_download_is_kept_on_range_not_satisfiable(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeFileHandler)
+        server.ranges = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/file.bin"
+        # загрузка закончилась, но задача не успела отметить страницу сохраненной
+        filename = os.path.join(tempfile.mkdtemp(), "file.bin")
+        with open(filename, "wb") as file:
+            file.write(RangeFileHandler.body)
+        job = SaveWebPagesTask([url])
+        job.filenames[url] = filename
+        job.offsets[url] = len(RangeFileHandler.body)
+        self.scheduler.schedule(job)
+
+        try:
+            self.scheduler.run()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(server.ranges, [f"bytes={len(RangeFileHandler.body)}-"])
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), RangeFileHandler.body)
+        self.assertTrue(check_task_in_completed(job.unique_name))
+
+    def test_web_pages_of_one_job_download_concurrently(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), SlowPageHandler)
+        server.lock = threading.Lock()
+        server.in_flight = server.max_in_flight = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = [f"http://127.0.0.1:{server.server_port}/{page}" for page in range(4)]
+        job = SaveWebPagesTask(urls, output_dir=tempfile.mkdtemp())
+        self.scheduler.schedule(job)
+
+        started = time.monotonic()
+        try:
+            self.scheduler.run()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # 4 страницы по 0.2с при лимите 2 на хост: около 0.4с вместо 0.8с по одной
+        self.assertLess(time.monotonic() - started, 0.7)
+        self.assertEqual(server.max_in_flight, 2)
+        self.assertEqual(job.urls, [])
+        for page, url in enumerate(urls):
+            with open(job.filenames[url], "rb") as file:
+                self.assertEqual(file.read(), f"/{page}".encode())
+        self.assertTrue(check_task_in_completed(job.unique_name))
+
+    def test_bench_scenario_reports_throughput_and_restart(self):
+        before = set(glob.glob(os.path.join(tempfile.gettempdir(), "scheduler-bench-*")))
+        result = run_scenario("random", "many_yield", 50, seed=1)
+
+        # временная директория сценария удаляется
+        self.assertEqual(set(glob.glob(os.path.join(tempfile.gettempdir(), "scheduler-bench-*"))), before)
+
+        self.assertEqual(result["completed"], 50)
+        self.assertEqual(result["restored_tasks"], 50)
+        self.assertGreater(result["steps_per_sec"], 0)
+        self.assertIn("p99", result["admission_latency_ms"])
+
+
+class AsyncSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = AsyncScheduler()
+
+    def tearDown(self):
+        self.scheduler.clean_up()
+
+    def test_wake_after_loop_closed(self):
+        self.scheduler.schedule(TestJob())
+        self.scheduler.run()
+        self.assertIsNone(self.scheduler._loop)
+
+        # wake из другого потока, пока run_async завершается: цикл событий уже закрыт
+        loop = asyncio.new_event_loop()
+        self.scheduler._loop, self.scheduler._async_wakeup = loop, asyncio.Event()
+        loop.close()
+        self.scheduler.wake()
+
+    def test_run_sync_and_async_jobs_with_dependencies(self):
+        sync_job = TestJob()
+        async_job = AsyncTestJob(dependencies=[sync_job])
+
+        self.scheduler.schedule(async_job)
+        self.scheduler.schedule(sync_job)
+        asyncio.run(self.scheduler.run_async())
+
+        self.assertTrue(check_task_in_completed(sync_job.unique_name))
+        self.assertTrue(check_task_in_completed(async_job.unique_name))
+
+    def test_sync_run_waits_for_delayed_job(self):
+        job = AsyncTestJob(start_at=datetime.now() + timedelta(seconds=0.2))
+        self.scheduler.schedule(job)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            self.scheduler.run()
+
+        self.assertTrue(check_task_in_completed(job.unique_name))
+
+    def test_async_jobs_wait_concurrently(self):
+        jobs = [AsyncTestJob(delay=0.3) for _ in range(5)]
+        for job in jobs:
+            self.scheduler.schedule(job)
+
+        started = time.monotonic()
+        asyncio.run(self.scheduler.run_async())
+
+        # Ожидания ввода-вывода разных задач пересекаются
+        self.assertLess(time.monotonic() - started, 0.3 * 2 * len(jobs) / 2)
+        for job in jobs:
+            self.assertTrue(check_task_in_completed(job.unique_name))
+
+
+class StoreWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "tasks.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_worker_processes_share_store(self):
+        store = TaskStore(self.path)
+        roots = [ManyStepsJob(5, 0.01) for _ in range(20)]
+        children = [ManyStepsJob(1, dependencies=[root]) for root in roots]
+        failing = FailingJob(max_tries=2)
+        store.submit(children + roots + [failing])
+
+        workers = [multiprocessing.Process(target=run_store_worker, args=(self.path,)) for _ in range(3)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join(30)
+
+        self.assertTrue(all(process.exitcode == 0 for process in workers))
+        self.assertEqual(store.counts(), {DONE: 40, FAILED: 1})
+        owners = store.connection.execute("SELECT COUNT(*) FROM tasks WHERE lease_owner IS NOT NULL").fetchone()
+        self.assertEqual(owners, (0,))
+        # попытки ведет хранилище: первая и два повтора
+        (tries, payload), = store.connection.execute(
+            "SELECT tries, payload FROM tasks WHERE id = ?", (failing.unique_name,)
+        ).fetchall()
+        self.assertEqual(tries, 2)
+        self.assertEqual(pickle.loads(payload).tries, 2)
+        store.close()
+
+    def test_failed_task_fails_its_dependents(self):
+        store = TaskStore(self.path)
+        failing = FailingJob(max_tries=1)
+        child = ManyStepsJob(1, dependencies=[failing])
+        grandchild = ManyStepsJob(1, dependencies=[child])
+        independent = ManyStepsJob(2)
+        store.submit([failing, child, grandchild, independent])
+
+        worker = multiprocessing.Process(target=run_store_worker, args=(self.path,))
+        worker.start()
+        worker.join(30)
+
+        # исполнитель не ждет задач, зависимости которых уже не выполнятся
+        self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(store.counts(), {DONE: 1, FAILED: 3})
+        self.assertFalse(store.has_unfinished())
+        # задача с неудачной зависимостью неудачна сразу при добавлении
+        late = ManyStepsJob(1, dependencies=[grandchild])
+        store.submit([late])
+        self.assertEqual(store.counts(), {DONE: 1, FAILED: 4})
+        store.close()
+
+    def test_expired_lease_is_reclaimed_as_failed_try(self):
+        store = TaskStore(self.path, lease_seconds=0.05)
+        root = ManyStepsJob(3, max_tries=1)
+        child = ManyStepsJob(1, dependencies=[root])
+        grandchild = ManyStepsJob(1, dependencies=[child])
+        store.submit([root, child, grandchild])
+        # исполнитель взял задачу и упал, не продлив аренду
+        self.assertEqual([job.unique_name for job in store.claim("dead", 10)], [root.unique_name])
+        self.assertEqual(store.claim("other", 10), [])
+        time.sleep(0.1)
+
+        reclaimed, = store.claim("alive", 10)
+        self.assertEqual(reclaimed.tries, 1)
+        self.assertEqual(store.heartbeat("dead", [root.unique_name], {}), [root.unique_name])
+        self.assertFalse(store.complete("dead", reclaimed))
+        self.assertTrue(store.complete("alive", reclaimed))
+        self.assertEqual(store.counts(), {DONE: 1, READY: 1, WAITING: 1})
+
+        # попытки кончились: задача не возвращается в очередь, зависимая от нее задача неудачна
+        store.claim("dead", 10)
+        time.sleep(0.1)
+        self.assertEqual(store.claim("alive", 10), [])
+        self.assertEqual(store.counts(), {DONE: 1, FAILED: 2})
+        store.close()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,130 @@
+import cProfile
+import json
+import os
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from job import JobId
+from logger import logger
+from settings import PROFILE_DIR, PROFILE_JOB_CLASSES, TRACE_FILE, TRACE_MAX_EVENTS
+
+
+def microseconds(seconds: float) -> float:
+    return round(seconds * 1_000_000, 3)
+
+
+def track(task) -> int:
+    # JSON-числа в просмотрщиках точны до 2**53, идентификатор задачи целиком пишется в args
+    return task.unique_name & 0x7FFFFFFF
+
+
+class NullTracer:
+    """Трассировка выключена: все вызовы ничего не делают"""
+
+    enabled = False
+
+    def step(self, task, started: float, seconds: float) -> None:
+        pass
+
+    def profiled(self, task, function: Callable, *args):
+        return function(*args)
+
+    def admitted(self, task, wait: float) -> None:
+        pass
+
+    def waiting(self, task) -> None:
+        pass
+
+    def released(self, task) -> None:
+        pass
+
+    def event(self, name: str, task) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class Tracer(NullTracer):
+    """Трассировка цикла планировщика в формате Chrome trace event (открывается в Perfetto и chrome://tracing).
+
+    У каждой задачи своя дорожка (tid по идентификатору задачи): ожидание зависимостей, ожидание места
+    в пуле, шаги и события retry, timeout, done и fail. События хранятся в кольцевом буфере на
+    max_events, старые вытесняются. Шаги задач классов из profile_classes выполняются под cProfile,
+    статистика пишется в <profile_dir>/<класс>.prof.
+    """
+
+    enabled = True
+
+    def __init__(self, path: Optional[str] = TRACE_FILE, max_events: int = TRACE_MAX_EVENTS,
+                 profile_classes: Iterable[str] = PROFILE_JOB_CLASSES, profile_dir: str = PROFILE_DIR):
+        self.path = path
+        self.events: Deque[dict] = deque(maxlen=max_events)
+        self.dropped = 0
+        self.pid = os.getpid()
+        # задача -> время, с которого она ждет зависимости
+        self.waiting_since: Dict[JobId, float] = {}
+        self.profile_classes = frozenset(profile_classes)
+        self.profile_dir = profile_dir
+        self.profilers: Dict[str, cProfile.Profile] = {}
+
+    def add(self, event: dict) -> None:
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+
+    def span(self, name: str, category: str, task, started: float, seconds: float) -> None:
+        self.add({
+            "name": name, "cat": category, "ph": "X", "ts": microseconds(started), "dur": microseconds(seconds),
+            "pid": self.pid, "tid": track(task),
+            "args": {"job": str(task.unique_name), "class": type(task).__name__},
+        })
+
+    def step(self, task, started: float, seconds: float) -> None:
+        self.span(type(task).__name__, "step", task, started, seconds)
+
+    def profiled(self, task, function: Callable, *args):
+        job_class = type(task).__name__
+        if job_class not in self.profile_classes:
+            return function(*args)
+        profiler = self.profilers.get(job_class)
+        if profiler is None:
+            profiler = self.profilers[job_class] = cProfile.Profile()
+        return profiler.runcall(function, *args)
+
+    def admitted(self, task, wait: float) -> None:
+        now = time.perf_counter()
+        self.add({
+            "name": "thread_name", "ph": "M", "pid": self.pid, "tid": track(task),
+            "args": {"name": f"{type(task).__name__} {task.unique_name}"},
+        })
+        self.span("admission", "admission", task, now - wait, wait)
+
+    def waiting(self, task) -> None:
+        self.waiting_since[task.unique_name] = time.perf_counter()
+
+    def released(self, task) -> None:
+        started = self.waiting_since.pop(task.unique_name, None)
+        if started is not None:
+            self.span("dependency_wait", "dependency_wait", task, started, time.perf_counter() - started)
+
+    def event(self, name: str, task) -> None:
+        self.add({
+            "name": name, "cat": "job", "ph": "i", "s": "t", "ts": microseconds(time.perf_counter()),
+            "pid": self.pid, "tid": track(task),
+            "args": {"job": str(task.unique_name), "class": type(task).__name__},
+        })
+
+    def close(self) -> None:
+        if self.path is not None:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump({"traceEvents": list(self.events), "otherData": {"dropped_events": self.dropped}}, file)
+            os.replace(tmp_path, self.path)
+            logger.info(f"Trace of {len(self.events)} events saved to {self.path}, {self.dropped} dropped")
+        if self.profilers:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            for job_class, profiler in self.profilers.items():
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{job_class}.prof"))
+            logger.info(f"Profiles of {sorted(self.profilers)} saved to {self.profile_dir}")
@@ -0,0 +1,134 @@
+import os
+import socket
+import time
+from typing import Iterable, List
+
+from exceptions import StopEventLoop
+from job import Job
+from logger import logger
+from scheduler import Scheduler
+from settings import POOL_SIZE, STORE_HEARTBEAT_SECONDS, STORE_POLL_INTERVAL, TASK_STORE
+from task_store import TaskStore
+
+
+class StoreWorker(Scheduler):
+    """Процесс-исполнитель, который берет задачи из общего хранилища TaskStore.
+
+    Несколько исполнителей на одной или разных машинах с общим файлом хранилища работают
+    параллельно: каждый берет в аренду столько готовых задач, сколько мест свободно в его пуле,
+    и выполняет их так же, как Scheduler. Итог задачи, зависимости и попытки фиксируются
+    в хранилище, поэтому локальный журнал и файл выполненных задач исполнителю не нужны.
+    """
+
+    def __init__(self, store_path=TASK_STORE, worker_id=None, pool_size: int = POOL_SIZE):
+        self.store = TaskStore(store_path)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._last_heartbeat = time.monotonic()
+        # после пустой попытки взять работу хранилище опрашивается не чаще STORE_POLL_INTERVAL
+        self._next_claim = 0.0
+        super().__init__(pool_size)
+
+    def is_resume_after_stop(self) -> bool:
+        # состояние задач хранится в TaskStore, а не в журнале процесса
+        return False
+
+    def create_done_list(self):
+        pass
+
+    def submit(self, jobs: Iterable[Job]) -> List[Job]:
+        return self.store.submit(jobs)
+
+    def claim_tasks(self) -> None:
+        """Берет в аренду готовые задачи на свободные места в пуле"""
+        free_slots = self.pool_size - len(self.running_tasks)
+        if self.control.draining or free_slots <= 0 or time.monotonic() < self._next_claim:
+            return
+        tasks = self.store.claim(self.worker_id, free_slots)
+        if not tasks:
+            self._next_claim = time.monotonic() + STORE_POLL_INTERVAL
+        for task in tasks:
+            if self.complete_from_cache(task):
+                continue
+            self.metrics.observe_queue_wait(task)
+            self.start_task(task)
+
+    def complete_task(self, task: Job) -> None:
+        self.store.complete(self.worker_id, task)
+
+    def fail_task(self, task: Job) -> None:
+        self.store.fail(self.worker_id, task)
+
+    def retry_task(self, task: Job) -> None:
+        # задача может продолжить на другом исполнителе, поэтому попытка начинается с чистого состояния
+        task.reset()
+        if self.store.retry(self.worker_id, task):
+            logger.debug(f"max_tries - {task.max_tries}, tries - {task.tries}")
+            self.metrics.inc("task_retries", task)
+            self.tracer.event("retry", task)
+        else:
+            logger.warning("Был достигнут максимум повторов выполнения задачи")
+            self.metrics.inc("task_failures", task)
+
+    def heartbeat(self) -> None:
+        """Продлевает аренду выполняемых задач и сохраняет в хранилище состояние изменившихся"""
+        if time.monotonic() - self._last_heartbeat < STORE_HEARTBEAT_SECONDS:
+            return
+        task_ids = [task.unique_name for task in self.tasks_mapping.values()]
+        lost = self.store.heartbeat(self.worker_id, task_ids, self.dirty_tasks)
+        self.dirty_tasks.clear()
+        self._last_heartbeat = time.monotonic()
+        if lost:
+            self.drop_tasks(set(lost))
+
+    def drop_tasks(self, task_ids: set) -> None:
+        """Убирает из пула задачи, аренду которых забрал другой исполнитель"""
+        for running_task, task in list(self.tasks_mapping.items()):
+            if task.unique_name not in task_ids:
+                continue
+            logger.warning(f"Lease of task {task.unique_name} is lost, task is dropped from pool")
+            self.running_tasks.remove(running_task)
+            self.parked_tasks.pop(running_task, None)
+            self.ready_tasks.task_stopped(self.tasks_mapping.pop(running_task))
+            close = getattr(running_task, "close", None)
+            if close is not None:
+                close()
+
+    def run(self):
+        self.open_control()
+        try:
+            while True:
+                self.check_control()
+                if self.control.paused:
+                    self.wait_wakeup(None)
+                    continue
+                tick_started = time.perf_counter()
+                self.claim_tasks()
+                if not self.running_tasks:
+                    if not self.store.has_unfinished():
+                        break
+                    self.wait_wakeup(STORE_POLL_INTERVAL)
+                    continue
+                progressed = self.step_running_tasks()
+                self.heartbeat()
+                self.metrics.export()
+                self.metrics.observe_tick(time.perf_counter() - tick_started)
+                if not progressed:
+                    timeout = self.get_wakeup_timeout()
+                    self.wait_wakeup(STORE_POLL_INTERVAL if timeout is None else min(timeout, STORE_POLL_INTERVAL))
+            logger.info(f"Worker {self.worker_id}: no unfinished tasks in store")
+        except StopEventLoop:
+            logger.info("Get stop signal from control channel")
+            self.stop()
+        except KeyboardInterrupt:
+            logger.info("Get stop signal from KeyboardInterrupt")
+            self.stop()
+        finally:
+            self.close_control()
+            self.shutdown_offload_pool()
+            self.store.close()
+
+    def stop(self, save_data=True) -> None:
+        """Возвращает задачи пула в хранилище, чтобы их сразу взяли другие исполнители"""
+        if save_data:
+            self.store.release(self.worker_id, list(self.tasks_mapping.values()))
+        logger.info(f"Worker {self.worker_id} stopped, {len(self.tasks_mapping)} tasks returned to store")